@@ -0,0 +1,201 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from os import path
+import pygame as pg
+from settings import *
+
+# Asset pack
+#
+# Loading the game used to decode every PNG and WAV one at a time, then scale some
+# of the images, every single time the game started. The packer below does all of
+# that once, offline, and writes the finished pixels (exactly what load_data would
+# have ended up with) and the decoded sound samples into one file:
+#
+#   header  - b"ZPAK", format version, length of the index
+#   index   - JSON: where every image and sound is in the file, plus a stamp
+#   data    - raw BGRA pixels and raw PCM samples, each 16 byte aligned
+#
+# The game maps the file into memory and makes its surfaces straight on top of the
+# mapped pixels with pg.image.frombuffer, so nothing has to be decoded or copied.
+#
+# Build the pack with:   python assetpack.py
+# If the pack is missing or out of date (an image, sound or size in settings.py
+# changed since it was built) the game just loads the normal files instead.
+
+MAGIC = b"ZPAK"
+VERSION = 1
+HEADER = struct.Struct("<4sII")
+ALIGN = 16
+
+game_folder = path.dirname(path.abspath(__file__))
+img_folder = path.join(game_folder, 'img')
+snd_folder = path.join(game_folder, 'snd')
+
+# Every image the game loads: name -> (file in img/, size to scale it to or None)
+def image_specs():
+    specs = {
+        'player': (PLAYER_IMG, None),
+        'mob': (MOB_IMG, None),
+        'wall': (WALL_IMG, (TILESIZE, TILESIZE)),
+        'bullet_lg': (BULLET_IMG, None),
+        'bullet_sm': (BULLET_IMG, (10, 10)),
+        'splat': (MOB_DEATH, (64, 64)),
+        'light_mask': (LIGHT_MASK, LIGHT_RADIUS),
+    }
+    for i, img in enumerate(MUZZLE_FLASHES):
+        specs['flash_%d' % i] = (img, None)
+    for item in ITEM_IMAGES:
+        specs['item_' + item] = (ITEM_IMAGES[item], None)
+    return specs
+
+# Every sound effect the game loads, as paths inside snd/ (music is streamed, so
+# it isn't packed)
+def sound_files():
+    files = list(EFFECTS_SOUNDS.values())
+    for sounds in WEAPON_SOUNDS.values():
+        files.extend(sounds)
+    files.extend(ZOMBIE_MOAN_SOUNDS)
+    files.extend(PLAYER_HIT_SOUNDS)
+    files.extend(ZOMBIE_HIT_SOUNDS)
+    # Keep the first of any duplicates, in order
+    return list(dict.fromkeys(files))
+
+# Fingerprint of everything that goes into the pack: the image specs, and the size
+# and modified time of every source file. If any of them change the pack is stale.
+def stamp():
+    parts = []
+    for name, (filename, size) in sorted(image_specs().items()):
+        st = os.stat(path.join(img_folder, filename))
+        parts.append("%s:%s:%s:%d:%d" % (name, filename, size, st.st_size, st.st_mtime_ns))
+    for filename in sound_files():
+        st = os.stat(path.join(snd_folder, filename))
+        parts.append("%s:%d:%d" % (filename, st.st_size, st.st_mtime_ns))
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+# Loads every image from img/ and scales it, the slow way. Needs a display mode set
+# (for convert_alpha). Returns a dictionary of name -> surface.
+def load_images():
+    images = {}
+    loaded = {}
+    for name, (filename, size) in image_specs().items():
+        # The same file can be used more than once (bullet_lg and bullet_sm)
+        if filename not in loaded:
+            loaded[filename] = pg.image.load(path.join(img_folder, filename)).convert_alpha()
+        image = loaded[filename]
+        if size:
+            image = pg.transform.scale(image, size)
+        images[name] = image
+    return images
+
+def pad(data):
+    return b"\0" * (-len(data) % ALIGN)
+
+# Writes images (name -> surface) and sounds (name -> pg.mixer.Sound) to a pack file
+def write_pack(filename,images,sounds):
+    index = {'stamp': stamp(), 'mixer': pg.mixer.get_init(), 'images': {}, 'sounds': {}}
+    blobs = []
+    offset = 0
+    for name, image in images.items():
+        pixels = pg.image.tobytes(image, "BGRA")
+        index['images'][name] = {'offset': offset, 'length': len(pixels), 'size': image.get_size()}
+        blobs.append(pixels + pad(pixels))
+        offset += len(blobs[-1])
+    for name, sound in sounds.items():
+        samples = sound.get_raw()
+        index['sounds'][name] = {'offset': offset, 'length': len(samples)}
+        blobs.append(samples + pad(samples))
+        offset += len(blobs[-1])
+
+    # Offsets above are from the start of the data, which comes after the header and
+    # index. The index gets longer as the offsets grow, so keep moving the data back
+    # until the index fits in front of it
+    start = 0
+    while True:
+        shifted = dict(index)
+        shifted['images'] = dict((name, dict(entry, offset=entry['offset'] + start))
+                                 for name, entry in index['images'].items())
+        shifted['sounds'] = dict((name, dict(entry, offset=entry['offset'] + start))
+                                 for name, entry in index['sounds'].items())
+        data = json.dumps(shifted).encode()
+        if HEADER.size + len(data) <= start:
+            break
+        start = HEADER.size + len(data)
+        start += -start % ALIGN
+    data += b" " * (start - HEADER.size - len(data))
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(data)))
+        f.write(data)
+        for blob in blobs:
+            f.write(blob)
+    return offset + start
+
+# A pack file opened for reading. The file stays mapped for as long as the pack is
+# around, because the surfaces it hands out point straight into it. It's mapped
+# copy on write, so drawing onto one of those surfaces never changes the file.
+class AssetPack:
+    def __init__(self,filename):
+        self.file = open(filename, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, version, length = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d asset pack" % (filename, VERSION))
+        self.index = json.loads(bytes(self.data[HEADER.size:HEADER.size + length]))
+        self.view = memoryview(self.data)
+
+    # True if the pack was built from the asset files as they are now
+    def fresh(self):
+        try:
+            return self.index['stamp'] == stamp()
+        except OSError:
+            return False
+
+    # Name -> surface for every image, without copying any pixels
+    def images(self):
+        images = {}
+        for name, entry in self.index['images'].items():
+            pixels = self.view[entry['offset']:entry['offset'] + entry['length']]
+            images[name] = pg.image.frombuffer(pixels, entry['size'], "BGRA")
+        return images
+
+    # The decoded sound for a file in snd/, or None if it isn't in the pack or was
+    # decoded for a different mixer setup than the one running now
+    def sound(self,filename):
+        entry = self.index['sounds'].get(filename)
+        if entry is None or pg.mixer.get_init() is None:
+            return None
+        if self.index['mixer'] is None or tuple(self.index['mixer']) != pg.mixer.get_init():
+            return None
+        return pg.mixer.Sound(buffer=self.view[entry['offset']:entry['offset'] + entry['length']])
+
+# Opens the pack if there's an up to date one, otherwise returns None
+def open_pack(filename):
+    if not path.exists(filename):
+        return None
+    try:
+        pack = AssetPack(filename)
+    except (OSError, ValueError):
+        return None
+    return pack if pack.fresh() else None
+
+# Builds the pack: python assetpack.py [output file]
+if __name__ == '__main__':
+    output = sys.argv[1] if len(sys.argv) > 1 else path.join(game_folder, ASSET_PACK)
+    # Same mixer setup as Game.__init__, so the decoded samples match what the game plays
+    pg.mixer.pre_init(44100, -16, 4, 2048)
+    pg.init()
+    pg.display.set_mode((1, 1), pg.HIDDEN)
+    images = load_images()
+    sounds = {}
+    if pg.mixer.get_init():
+        for filename in sound_files():
+            sounds[filename] = pg.mixer.Sound(path.join(snd_folder, filename))
+    else:
+        print("No audio device, sounds won't be packed")
+    size = write_pack(output, images, sounds)
+    print("Wrote %d images and %d sounds to %s (%.1f MB)" % (len(images), len(sounds), output, size / 2 ** 20))
+    pg.quit()
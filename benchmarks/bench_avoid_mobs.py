@@ -0,0 +1,95 @@
+'''
+    Benchmark for mob separation steering (Mob.avoid_mobs)
+
+    Compares the old "every mob checks every other mob" loop against the
+    spatial hash, for hordes from 100 up to 10,000 mobs. Mobs are scattered
+    over an arena that grows with the horde, so the crowd density stays the
+    same and only the number of mobs changes.
+
+    Usage (from the root folder of the game):
+        python benchmarks/bench_avoid_mobs.py
+        python benchmarks/bench_avoid_mobs.py --counts 100 1000 10000 --brute-max 2000
+'''
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+# The game modules live in the folder above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame as pg
+from settings import *
+from sprites import Mob
+from spatial import SpatialHash
+
+# Average area (in square pixels) each mob gets in the arena.
+# 40x40 is a tightly packed horde, where separation actually has work to do.
+AREA_PER_MOB = 40 * 40
+
+# Just enough of a Game for Mob.__init__ and Mob.avoid_mobs to work
+class BenchGame:
+    def __init__(self,count,seed):
+        self.all_sprites = pg.sprite.LayeredUpdates()
+        self.mobs = pg.sprite.Group()
+        self.mob_img = pg.Surface((43, 35))
+        self.player = None
+        self.mob_speed = MOB_SPEEDS[0]
+        self.mob_grid = SpatialHash(AVOID_RADIUS)
+        rng = random.Random(seed)
+        side = math.sqrt(count * AREA_PER_MOB)
+        for i in range(count):
+            Mob(self, rng.uniform(0, side), rng.uniform(0, side))
+
+# The original O(N^2) version of avoid_mobs, kept here to compare against
+def brute_avoid(mob, mobs):
+    for other in mobs:
+        if other != mob:
+            dist = mob.pos - other.pos
+            if 0 < dist.length() < AVOID_RADIUS:
+                mob.acc += dist.normalize()
+
+def frame_grid(game):
+    game.mob_grid.rebuild(game.mobs)
+    for mob in game.mobs:
+        mob.avoid_mobs()
+
+def frame_brute(game):
+    for mob in game.mobs:
+        brute_avoid(mob, game.mobs)
+
+# Runs one "frame" of separation a few times and returns the best time in milliseconds
+def time_frame(func, game, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        func(game)
+        taken = (time.perf_counter() - start) * 1000
+        if best is None or taken < best:
+            best = taken
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Mob.avoid_mobs against horde size")
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 300, 1000, 3000, 10000])
+    parser.add_argument('--brute-max', type=int, default=3000,
+                        help="largest horde to run the O(N^2) version on (it gets very slow)")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>9}".format("mobs", "grid (ms)", "brute (ms)", "speedup"))
+    for count in args.counts:
+        game = BenchGame(count, args.seed)
+        grid = time_frame(frame_grid, game, args.repeats)
+        if count <= args.brute_max:
+            brute = time_frame(frame_brute, game, args.repeats)
+            print("{:>8} {:>12.2f} {:>12.2f} {:>8.1f}x".format(count, grid, brute, brute / grid))
+        else:
+            print("{:>8} {:>12.2f} {:>12} {:>9}".format(count, grid, "-", "-"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+    Benchmark for the mob level of detail scheduler (lod.py)
+
+    Runs the game headless on the large benchmark map (256x256 tiles, walls
+    scattered around, the player walking a big circle) with hordes from 500 up
+    to 5000 mobs spread over the whole map, once with LOD off and once with it
+    on, and compares how long a game tick takes. With LOD on it also shows how
+    many mobs were in each tier.
+
+    Usage (from the root folder of the game):
+        python benchmarks/bench_lod.py
+        python benchmarks/bench_lod.py --counts 1000 10000 --ticks 600
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# The game modules live in the folder above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as game_main
+from suite import large_map, write_tmx, drive
+
+# Average ms per tick over ticks game ticks, and the game (for its LOD stats)
+def run(map_file,lod,ticks,seed):
+    game_main.LOD = lod
+    game = game_main.Game(headless=True)
+    game.new(map_file, seed=seed)
+    game.dt = 1 / game_main.SIM_RATE
+    game.alpha = 1.0
+    # Nothing can kill the player, so every run is exactly ticks long
+    game.player.health = float('inf')
+    start = time.perf_counter()
+    for tick in range(ticks):
+        drive('large', game, tick)
+        game.step()
+    return (time.perf_counter() - start) * 1000 / ticks, game
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the mob LOD scheduler against horde size")
+    parser.add_argument('--counts', type=int, nargs='+', default=[500, 1000, 2000, 5000])
+    parser.add_argument('--ticks', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='zombie_lod_')
+    print("{:>8} {:>12} {:>12} {:>9}   {}".format("mobs", "off (ms)", "on (ms)", "speedup",
+                                                  "on screen / near / dormant (average)"))
+    for count in args.counts:
+        rng = random.Random(args.seed)
+        width, height, objects = large_map(count, rng)
+        map_file = os.path.join(folder, 'lod_%d.tmx' % count)
+        write_tmx(map_file, width, height, objects, rng)
+        off, game = run(map_file, "OFF", args.ticks, args.seed)
+        on, game = run(map_file, "ON", args.ticks, args.seed)
+        tiers = " / ".join("{:.0f}".format(n / max(1, game.lod.tick)) for n in game.lod.counts)
+        print("{:>8} {:>12.2f} {:>12.2f} {:>8.1f}x   {}".format(count, off, on, off / on, tiers))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+    Benchmark for loading maps: pytmx vs compiled maps (mapcompiler.py)
+
+    Generates .tmx maps from 64x48 tiles (about the size of level1) up to
+    1024x1024, with walls around the edge and zombies scattered around, compiles
+    each one, and times:
+
+        pytmx     - TiledMap (pytmx.load_pygame), what the game did before
+        compiled  - opening the compiled map (CompiledMap)
+        + screen  - opening the compiled map and drawing the first screen of it,
+                    which is when it loads the tileset image (pytmx loads that up
+                    front, so this is the fair comparison)
+
+    Every time is the best of --repeats runs.
+
+    Usage (from the root folder of the game):
+        python benchmarks/bench_maps.py
+        python benchmarks/bench_maps.py --sizes 64x48 256x256 --repeats 5
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# The game modules live in the folder above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame as pg
+from settings import *
+from tilemap import TiledMap
+from mapcompiler import compile_map, CompiledMap
+from suite import write_tmx, border
+
+# Best time (in ms) out of repeats runs of load()
+def best(load,repeats):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        load()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+def open_and_draw(filename):
+    compiled = CompiledMap(filename)
+    screen = pg.Surface((WIDTH, HEIGHT))
+    compiled.render_area(screen, screen.get_rect())
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading maps with pytmx against compiled maps")
+    parser.add_argument('--sizes', nargs='+', default=['64x48', '128x128', '256x256', '512x512', '1024x1024'],
+                        help="map sizes in tiles, as WIDTHxHEIGHT")
+    parser.add_argument('--zombies', type=int, default=200)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    pg.init()
+    # pytmx and the compiled maps both need a display mode to convert the tiles
+    pg.display.set_mode((WIDTH, HEIGHT))
+    folder = tempfile.mkdtemp(prefix='zombie_maps_')
+
+    print("{:>10} {:>10} {:>10} {:>12} {:>12} {:>10} {:>9}".format(
+          "tiles", "tmx KB", "zmap KB", "pytmx (ms)", "compiled", "+ screen", "speedup"))
+    for size in args.sizes:
+        width, height = (int(n) for n in size.lower().split('x'))
+        rng = random.Random(args.seed)
+        objects = border(width, height)
+        objects.append(('player', width * 32, height * 32, 64, 64))
+        for i in range(args.zombies):
+            objects.append(('zombie', rng.randrange(64, (width - 2) * 64), rng.randrange(64, (height - 2) * 64), 32, 32))
+        tmx = os.path.join(folder, 'map_%dx%d.tmx' % (width, height))
+        write_tmx(tmx, width, height, objects, rng)
+        zmap = compile_map(tmx)
+
+        pytmx_ms = best(lambda: TiledMap(tmx), args.repeats)
+        compiled_ms = best(lambda: CompiledMap(zmap), args.repeats)
+        screen_ms = best(lambda: open_and_draw(zmap), args.repeats)
+        print("{:>10} {:>10.0f} {:>10.0f} {:>12.1f} {:>10.2f} {:>10.1f} {:>8.0f}x".format(
+              size, os.path.getsize(tmx) / 1024, os.path.getsize(zmap) / 1024,
+              pytmx_ms, compiled_ms, screen_ms, pytmx_ms / screen_ms))
+    pg.quit()
+
+if __name__ == '__main__':
+    main()
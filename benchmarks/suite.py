@@ -0,0 +1,310 @@
+'''
+    Benchmark suite
+
+    Runs the real Game (headless, drawing to an in-memory screen) through a set of
+    generated scenarios, with a fixed random seed so every run plays out the same:
+
+        arena    - a horde of mobs closing in on the player in an open arena
+        maze     - a horde in a walled maze (flow field and wall collisions)
+        shotgun  - the player spinning on the spot firing the shotgun every frame
+        large    - a 256x256 tile map, the player walking a big circle around it
+        world    - the endless world (WORLD_MODE) with the batched mob engine
+                   (BATCHED_MOBS), the player walking straight through it so
+                   regions keep loading and unloading
+
+    The player can't die, so every scenario runs for exactly --frames frames.
+    Each scenario runs in its own python process so peak memory is its own.
+    Reports frames per second, p99 frame time and peak memory, and writes them
+    to a JSON file. Given a baseline file from an earlier run, any scenario that
+    got slower (or bigger) by more than --tolerance counts as a regression, and
+    the exit code is 1.
+
+    Usage (from the root folder of the game):
+        python benchmarks/suite.py
+        python benchmarks/suite.py --output new.json --baseline old.json --tolerance 0.15
+        python benchmarks/suite.py --scenarios arena maze --mobs 500 --frames 300
+'''
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+SCENARIOS = ['arena', 'maze', 'shotgun', 'large', 'world']
+
+# Writes a .tmx map of width x height tiles (all grass), with objects as a list
+# of (name, x, y, width, height) in pixels
+def write_tmx(filename,width,height,objects,rng):
+    tileset = os.path.join(ROOT, 'img', 'spritesheet_tiles.png')
+    rows = []
+    for y in range(height):
+        rows.append(",".join(str(rng.randint(1, 4)) for x in range(width)))
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<map version="1.0" orientation="orthogonal" renderorder="right-down" '
+                'width="%d" height="%d" tilewidth="64" tileheight="64" infinite="0" '
+                'nextobjectid="%d">\n' % (width, height, len(objects) + 1))
+        f.write(' <tileset firstgid="1" name="spritesheet_tiles" tilewidth="64" tileheight="64" '
+                'spacing="10" tilecount="540" columns="27">\n')
+        f.write('  <image source="%s" width="1988" height="1470"/>\n' % tileset)
+        f.write(' </tileset>\n')
+        f.write(' <layer name="ground" width="%d" height="%d">\n' % (width, height))
+        f.write('  <data encoding="csv">\n%s\n</data>\n' % ",\n".join(rows))
+        f.write(' </layer>\n')
+        f.write(' <objectgroup name="objects">\n')
+        for i, (name, x, y, w, h) in enumerate(objects):
+            f.write('  <object id="%d" name="%s" x="%d" y="%d" width="%d" height="%d"/>\n'
+                    % (i + 1, name, x, y, w, h))
+        f.write(' </objectgroup>\n')
+        f.write('</map>\n')
+
+# Walls around the edge of a width x height tile map
+def border(width,height):
+    return [('wall', 0, 0, width * 64, 64), ('wall', 0, (height - 1) * 64, width * 64, 64),
+            ('wall', 0, 64, 64, (height - 2) * 64), ('wall', (width - 1) * 64, 64, 64, (height - 2) * 64)]
+
+# Mobs scattered in a ring around (x, y), all close enough to see the player
+def ring(count,x,y,rng):
+    objects = []
+    for i in range(count):
+        angle = rng.uniform(0, math.tau)
+        dist = rng.uniform(200, 900)
+        objects.append(('zombie', x + math.cos(angle) * dist - 16, y + math.sin(angle) * dist - 16, 32, 32))
+    return objects
+
+def arena_map(mobs,rng):
+    objects = [('player', 40 * 64 - 16, 40 * 64 - 16, 32, 32)] + border(80, 80)
+    objects += ring(mobs, 40 * 64, 40 * 64, rng)
+    return 80, 80, objects
+
+# A maze of 2 tile wide corridors (recursive backtracker), with the player in the middle
+def maze_map(mobs,rng):
+    cells = 16
+    size = cells * 3 + 1
+    open_tiles = set()
+    stack = [(cells // 2, cells // 2)]
+    seen = {stack[0]}
+    while stack:
+        cx, cy = stack[-1]
+        open_tiles.update((cx * 3 + 1 + dx, cy * 3 + 1 + dy) for dx in (0, 1) for dy in (0, 1))
+        options = [(cx + dx, cy + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                   if 0 <= cx + dx < cells and 0 <= cy + dy < cells and (cx + dx, cy + dy) not in seen]
+        if not options:
+            stack.pop()
+            continue
+        nx, ny = rng.choice(options)
+        # Knock down the wall between the two cells
+        for i in (0, 1):
+            if nx != cx:
+                open_tiles.add((max(cx, nx) * 3, cy * 3 + 1 + i))
+            else:
+                open_tiles.add((cx * 3 + 1 + i, max(cy, ny) * 3))
+        seen.add((nx, ny))
+        stack.append((nx, ny))
+
+    # Every wall tile, joined into horizontal runs so there are fewer wall objects
+    objects = []
+    for y in range(size):
+        x = 0
+        while x < size:
+            if (x, y) in open_tiles:
+                x += 1
+                continue
+            start = x
+            while x < size and (x, y) not in open_tiles:
+                x += 1
+            objects.append(('wall', start * 64, y * 64, (x - start) * 64, 64))
+    middle = (cells // 2) * 3 + 1
+    objects.insert(0, ('player', middle * 64 + 48, middle * 64 + 48, 32, 32))
+    tiles = sorted(open_tiles)
+    for i in range(mobs):
+        x, y = rng.choice(tiles)
+        objects.append(('zombie', x * 64 + 16, y * 64 + 16, 32, 32))
+    return size, size, objects
+
+def shotgun_map(mobs,rng):
+    width, height, objects = arena_map(mobs, rng)
+    return width, height, objects + [('wall', 30 * 64, 30 * 64, 20 * 64, 64), ('wall', 30 * 64, 50 * 64, 20 * 64, 64)]
+
+def large_map(mobs,rng):
+    objects = [('player', 128 * 64 - 16, 128 * 64 - 16, 32, 32)] + border(256, 256)
+    for i in range(400):
+        objects.append(('wall', rng.randint(2, 250) * 64, rng.randint(2, 250) * 64,
+                        rng.randint(1, 4) * 64, rng.randint(1, 4) * 64))
+    for i in range(mobs):
+        objects.append(('zombie', rng.randint(2, 250) * 64 + 16, rng.randint(2, 250) * 64 + 16, 32, 32))
+    return 256, 256, objects
+
+MAPS = {'arena': arena_map, 'maze': maze_map, 'shotgun': shotgun_map, 'large': large_map}
+
+# Things the scenario does to the game before every frame
+def drive(name,game,frame):
+    player = game.player
+    if name == 'shotgun':
+        # Fire every frame, whatever the weapons fire rate, to keep lots of bullets flying
+        player.weapon = 'shotgun'
+        player.rot = (player.rot + 3) % 360
+        player.last_shot = -1e9
+        player.shoot()
+    if name == 'large':
+        # Walk a circle of radius 3000 pixels around the middle of the map, once every 60s
+        angle = frame / (60 * 60) * math.tau
+        player.pos.x = 128 * 64 + math.cos(angle) * 3000
+        player.pos.y = 128 * 64 + math.sin(angle) * 3000
+    if name == 'world':
+        # Walk east at 960 pixels a second (faster than the player can, to get through
+        # lots of regions), weaving up and down a bit
+        x, y = game.world.start
+        player.pos.x = x + frame * 16
+        player.pos.y = y + math.sin(frame / 120) * 1500
+
+# Runs one scenario in this process and returns its results
+def run_scenario(name,frames,mobs,seed):
+    sys.path.insert(0, ROOT)
+    import main
+
+    if name == 'world':
+        # The world makes itself up from the seed, there's no map file
+        main.WORLD_MODE = "ON"
+        main.BATCHED_MOBS = "ON"
+        map_file = None
+    else:
+        rng = random.Random(seed)
+        width, height, objects = MAPS[name](mobs, rng)
+        folder = tempfile.mkdtemp()
+        map_file = os.path.join(folder, name + '.tmx')
+        write_tmx(map_file, width, height, objects, rng)
+
+    game = main.Game(headless=True)
+    game.new(map_file, seed=seed)
+    game.playing = True
+    game.dt = 1 / main.SIM_RATE
+    game.alpha = 1.0
+
+    times = []
+    most_bullets = 0
+    for frame in range(frames):
+        drive(name, game, frame)
+        start = time.perf_counter()
+        game.events()
+        game.step()
+        game.draw()
+        times.append((time.perf_counter() - start) * 1000)
+        most_bullets = max(most_bullets, len(game.bullets))
+        # Nobody dies and nobody wins, so the scenario always runs every frame
+        game.player.health = main.PLAYER_HEALTH
+        game.playing = True
+
+    if map_file:
+        os.remove(map_file)
+        os.rmdir(folder)
+    times_sorted = sorted(times)
+    return {
+        'frames': frames,
+        'fps': frames / (sum(times) / 1000),
+        'mean_ms': sum(times) / frames,
+        'p50_ms': times_sorted[int(round((frames - 1) * 0.5))],
+        'p99_ms': times_sorted[int(round((frames - 1) * 0.99))],
+        'peak_memory_mb': peak_memory(),
+        'mobs_left': len(game.mobs),
+        'most_bullets': most_bullets,
+    }
+
+# Peak memory use of this process in MB, or None if we can't tell (Windows)
+def peak_memory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives KB, macOS gives bytes
+    if sys.platform == 'darwin':
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+# Runs a scenario in a new python process and returns its results
+def run_in_process(name,args):
+    env = dict(os.environ)
+    command = [sys.executable, os.path.abspath(__file__), '--run-one', name, '--frames', str(args.frames),
+               '--mobs', str(args.mobs), '--seed', str(args.seed)]
+    output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    # The results are the last line printed, anything before it is the game talking
+    return json.loads(output.strip().splitlines()[-1])
+
+# Compares results against a baseline. Returns a list of (scenario, what, old, new)
+# for everything that got worse by more than tolerance (0.1 = 10%).
+def regressions(results,baseline,tolerance):
+    found = []
+    for name, new in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        if new['fps'] < old['fps'] * (1 - tolerance):
+            found.append((name, 'fps', old['fps'], new['fps']))
+        for key in ('p99_ms', 'peak_memory_mb'):
+            if old.get(key) and new.get(key) and new[key] > old[key] * (1 + tolerance):
+                found.append((name, key, old[key], new[key]))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark scenarios and compare against a baseline")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--mobs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="results file from an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="how much worse (0.1 = 10%%) a result can get before it's a regression")
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_scenario(args.run_one, args.frames, args.mobs, args.seed)))
+        return
+
+    sys.path.insert(0, ROOT)
+    import settings
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'frames': args.frames,
+            'mobs': args.mobs,
+            'seed': args.seed,
+            'settings': dict((name, getattr(settings, name)) for name in
+                             ('BATCHED_MOBS', 'BULLET_POOL', 'DIRTY_RECTS', 'SIM_RATE')),
+        },
+        'scenarios': {},
+    }
+    print("{:<10}{:>10}{:>10}{:>10}{:>12}".format("scenario", "fps", "p50 ms", "p99 ms", "peak MB"))
+    for name in args.scenarios:
+        result = run_in_process(name, args)
+        results['scenarios'][name] = result
+        print("{:<10}{:>10.1f}{:>10.2f}{:>10.2f}{:>12.1f}".format(name, result['fps'], result['p50_ms'],
+                                                              result['p99_ms'], result['peak_memory_mb'] or 0))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results written to", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.tolerance)
+        for name, key, old, new in found:
+            print("REGRESSION {}: {} {:.2f} -> {:.2f}".format(name, key, old, new))
+        if found:
+            sys.exit(1)
+        print("No regressions (tolerance {:.0%})".format(args.tolerance))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import pygame as pg
+import random
+from settings import *
+from sprites import PooledBullet
+# numpy (if it's installed) comes from the mob engine, so there's one place that checks
+from mobengine import np, HAVE_NUMPY
+
+# Bullet pool
+#
+# The shotgun fires 12 bullets a shot, and every Bullet used to be a brand new
+# sprite with its own vectors that got thrown away a second later. The pool makes
+# a fixed number of PooledBullet sprites once, keeps the state of every bullet in
+# numpy arrays, and just hands slots out and takes them back.
+#
+# Every frame all the live bullets are moved at once, and tested against every
+# wall and every nearby mob at once, instead of one bullet at a time. The tests are
+# swept (see sweep below), so fast bullets can't skip through thin walls or mobs.
+class BulletPool:
+    def __init__(self,game,capacity=BULLET_POOL_SIZE):
+        self.game = game
+        self.capacity = capacity
+
+        self.pos = np.zeros((capacity, 2))
+        # Where each bullet was at the start of the frame
+        self.last_pos = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        # Half the width/height of the bullets image (bullets are centered on pos)
+        self.half = np.zeros((capacity, 2))
+        self.spawn_time = np.zeros(capacity)
+        self.lifetime = np.zeros(capacity)
+        self.damage = np.zeros(capacity)
+        self.live = np.zeros(capacity, dtype=bool)
+        # Bullets that hit a wall this frame. They're removed at the start of the next
+        # update, so they can still hit any mob between them and the wall first
+        self.stopped = np.zeros(capacity, dtype=bool)
+
+        # The sprites are made once here and reused for the rest of the game
+        self.sprites = [PooledBullet(game, slot) for slot in range(capacity)]
+        # Free slots. Once a bullet dies its slot goes back on the end of the list
+        self.free = list(range(capacity - 1, -1, -1))
+
+        # Wall rects as an (n, 4) array of left, top, right, bottom. Built on the
+        # first update, once the map has loaded all the walls
+        self.walls = None
+
+    # Fires a bullet from pos in direction dir (a unit vector) for a weapon from WEAPONS
+    def fire(self,pos,dir,weapon):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            # Pool is full: recycle the oldest bullet still flying
+            slot = int(np.argmin(np.where(self.live, self.spawn_time, np.inf)))
+            self.release(slot)
+            self.free.pop()
+
+        sprite = self.sprites[slot]
+        sprite.fire(self.game.bullet_images[weapon['bullet_size']], pos, weapon['damage'])
+        self.pos[slot] = (pos[0], pos[1])
+        self.last_pos[slot] = (pos[0], pos[1])
+        speed = weapon['bullet_speed'] * random.uniform(0.9,1.1)
+        self.vel[slot] = (dir[0] * speed, dir[1] * speed)
+        self.half[slot] = (sprite.rect.width / 2, sprite.rect.height / 2)
+        self.spawn_time[slot] = self.game.sim_time
+        self.lifetime[slot] = weapon['bullet_lifetime']
+        self.damage[slot] = weapon['damage']
+        self.live[slot] = True
+
+    # Takes a bullet out of the game and gives its slot back
+    def release(self,slot):
+        if self.live[slot]:
+            self.live[slot] = False
+            self.stopped[slot] = False
+            self.sprites[slot].kill()
+            self.free.append(slot)
+
+    def load_walls(self):
+        rects = [wall.rect for wall in self.game.walls]
+        self.walls = np.array([(r.left, r.top, r.right, r.bottom) for r in rects],
+                              dtype=float).reshape(-1, 4)
+
+    # Moves every live bullet, then kills the ones that are too old and stops the
+    # ones that hit a wall
+    def update(self,dt):
+        if self.walls is None:
+            self.load_walls()
+        for slot in np.flatnonzero(self.stopped):
+            self.release(slot)
+        slots = np.flatnonzero(self.live)
+        if len(slots) == 0:
+            return
+
+        self.last_pos[slots] = self.pos[slots]
+        self.pos[slots] += self.vel[slots] * dt
+
+        # Bullets that have lived longer than their weapons bullet_lifetime
+        now = self.game.sim_time
+        dead = now - self.spawn_time[slots] > self.lifetime[slots]
+        for slot in slots[dead]:
+            self.release(slot)
+        slots = slots[~dead]
+
+        # Every live bullet against every wall in one go. Bullets that hit one are
+        # moved back to where they touched the first wall along their path
+        if len(self.walls) and len(slots):
+            t = sweep(self.last_pos[slots], self.pos[slots], self.half[slots],
+                      self.walls).min(axis=1)
+            hit = np.isfinite(t)
+            start = self.last_pos[slots[hit]]
+            self.pos[slots[hit]] = start + (self.pos[slots[hit]] - start) * t[hit][:, None]
+            self.stopped[slots[hit]] = True
+
+        for slot in slots:
+            self.sprites[slot].rect.center = self.pos[slot]
+
+    # Works like pg.sprite.groupcollide(mobs, bullets, False, True, collide_swept):
+    # returns a dictionary of mob -> list of bullets that hit it, and removes those
+    # bullets. A bullet only hits the first mob along its path this frame.
+    def collide_mobs(self,mobs):
+        slots = np.flatnonzero(self.live)
+        hits = {}
+        if len(slots) == 0 or len(mobs) == 0:
+            return hits
+
+        # Only mobs touching the box around every bullets path this frame can be hit.
+        # With a big horde that's only a few of them, and the (bullets, mobs) arrays
+        # in sweep stay small.
+        start = self.last_pos[slots]
+        end = self.pos[slots]
+        half = self.half[slots]
+        left, top = np.floor((np.minimum(start, end) - half).min(axis=0))
+        right, bottom = np.ceil((np.maximum(start, end) + half).max(axis=0))
+        area = pg.Rect(int(left), int(top), int(right - left) + 1, int(bottom - top) + 1)
+        mobs = mobs.sprites()
+        mobs = [mobs[i] for i in area.collidelistall([mob.rect for mob in mobs])]
+        if not mobs:
+            return hits
+
+        rects = np.array([(m.rect.left, m.rect.top, m.rect.right, m.rect.bottom) for m in mobs],
+                         dtype=float)
+        t = sweep(start, end, half, rects)
+        hit = np.isfinite(t).any(axis=1)
+        first_mob = t.argmin(axis=1)
+
+        for slot, mob in zip(slots[hit], first_mob[hit]):
+            bullet = self.sprites[slot]
+            hits.setdefault(mobs[mob], []).append(bullet)
+            self.release(slot)
+        return hits
+
+# Swept box test of every bullet against every rect, the numpy version of
+# sweep_rect in spatial.py. Bullet i is a box of half size half[i] moving from
+# start[i] to end[i], and rects is an array of left, top, right, bottom.
+# Returns a (bullets, rects) array of how far along its move (0 to 1) each bullet
+# first touches each rect, or infinity if it doesn't.
+def sweep(start,end,half,rects):
+    t_enter = np.zeros((len(start), len(rects)))
+    t_exit = np.ones((len(start), len(rects)))
+    for axis in (0, 1):
+        p = start[:, axis:axis + 1]
+        d = end[:, axis:axis + 1] - p
+        # Growing each rect by the bullets size means we only have to trace a point
+        lo = rects[None, :, axis] - half[:, axis:axis + 1]
+        hi = rects[None, :, axis + 2] + half[:, axis:axis + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t1 = (lo - p) / d
+            t2 = (hi - p) / d
+        # Bullets not moving on this axis are either always inside the slab or never
+        still = d == 0
+        inside = (lo < p) & (p < hi)
+        near = np.where(still, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+        far = np.where(still, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+        t_enter = np.maximum(t_enter, near)
+        t_exit = np.minimum(t_exit, far)
+    return np.where(t_enter < t_exit, t_enter, np.inf)
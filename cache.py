@@ -0,0 +1,81 @@
+import pygame as pg
+from collections import OrderedDict
+from settings import *
+
+# Cache of pre-rotated copies of an image
+#
+# pg.transform.rotate is slow, and Player/Mob used to call it on their image every
+# single frame. Instead, angles are rounded to the nearest ROTATION_STEP degrees,
+# and each rounded angle is only rotated once, the first time it's asked for.
+# Only the `size` most recently used angles are kept (least recently used ones
+# get thrown out first), so memory can't grow forever.
+class RotationCache:
+    def __init__(self,image,step=ROTATION_STEP,size=ROTATION_CACHE_SIZE):
+        self.image = image
+        self.step = step
+        # Number of different angles there are with this step
+        self.angles = max(1, int(round(360 / step)))
+        self.size = size
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,angle):
+        key = int(round(angle / self.step)) % self.angles
+        frame = self.frames.get(key)
+        if frame is None:
+            self.misses += 1
+            frame = pg.transform.rotate(self.image, key * 360 / self.angles)
+            self.frames[key] = frame
+            if len(self.frames) > self.size:
+                self.frames.popitem(last=False)
+        else:
+            self.hits += 1
+            self.frames.move_to_end(key)
+        return frame
+
+# Cache for fonts and rendered text (used by Game.draw_text)
+#
+# Opening a font reads and parses the whole .ttf file, and draw_text used to do
+# that (and render the text again) every frame for the HUD. Fonts are kept by
+# (file, size), and rendered text surfaces by (text, font file, size, colour),
+# so text that doesn't change (like "Paused") is only ever rendered once.
+# Both caches throw out the least recently used entry once they are full.
+class TextCache:
+    def __init__(self,size=TEXT_CACHE_SIZE,font_size=FONT_CACHE_SIZE):
+        self.size = size
+        self.font_size = font_size
+        self.fonts = OrderedDict()
+        self.texts = OrderedDict()
+        self.font_hits = 0
+        self.font_misses = 0
+        self.hits = 0
+        self.misses = 0
+
+    def font(self,font_name,size):
+        key = (font_name, size)
+        font = self.fonts.get(key)
+        if font is None:
+            self.font_misses += 1
+            font = pg.font.Font(font_name, size)
+            self.fonts[key] = font
+            if len(self.fonts) > self.font_size:
+                self.fonts.popitem(last=False)
+        else:
+            self.font_hits += 1
+            self.fonts.move_to_end(key)
+        return font
+
+    def render(self,text,font_name,size,color):
+        key = (text, font_name, size, tuple(color))
+        surface = self.texts.get(key)
+        if surface is None:
+            self.misses += 1
+            surface = self.font(font_name, size).render(text, True, color)
+            self.texts[key] = surface
+            if len(self.texts) > self.size:
+                self.texts.popitem(last=False)
+        else:
+            self.hits += 1
+            self.texts.move_to_end(key)
+        return surface
@@ -0,0 +1,137 @@
+import heapq
+from math import sqrt
+from settings import *
+
+# Flow field pathfinding towards the player
+#
+# Mobs used to walk in a straight line at the player and slide along walls, so
+# they piled up behind them. Running A* for every mob would be far too slow with
+# hundreds of mobs, so instead one Dijkstra search is run outwards from the
+# players tile, over the tile grid. Every tile then points at the neighbouring tile
+# that is closest to the player, and any mob can look up which way to walk in O(1),
+# no matter how many mobs there are.
+#
+# The search only has to be run again when the player moves onto a different tile,
+# and only spreads out as far as FLOW_RADIUS pixels of walking distance (mobs
+# further away than DETECT_RADIUS don't chase the player anyway).
+class FlowField:
+    # The field covers width x height pixels, with its top left at origin (which must
+    # be on a tile corner). It's the whole map, unless the map is endless (world.py).
+    def __init__(self,walls,width,height,tilesize=TILESIZE,radius=FLOW_RADIUS,blocked=None,origin=(0,0)):
+        self.tilesize = tilesize
+        self.cols = int(-(-width // tilesize))
+        self.rows = int(-(-height // tilesize))
+        # Tile the top left of the field is on
+        self.left = int(origin[0] // tilesize)
+        self.top = int(origin[1] // tilesize)
+        # Walking distance limit, in tiles
+        self.radius = radius / tilesize
+
+        # A tile is blocked if any wall covers part of it (touching its edge doesn't count).
+        # Compiled maps already know which tiles are blocked, and pass them in.
+        if blocked is not None:
+            self.blocked = bytearray(blocked)
+        else:
+            self.blocked = bytearray(self.cols * self.rows)
+            for wall in walls:
+                self.block(wall.rect)
+
+        # For every tile: distance to the player in tiles (-1 = not reached) and the
+        # unit vector pointing the way to go. Stored as flat lists, index = y * cols + x
+        self.dist = [-1] * (self.cols * self.rows)
+        self.dir_x = [0.0] * (self.cols * self.rows)
+        self.dir_y = [0.0] * (self.cols * self.rows)
+        # Tile the field currently leads to, and a counter that goes up every time
+        # the field changes (so anything caching it knows to refresh)
+        self.goal = None
+        self.version = 0
+
+    def block(self,rect):
+        size = self.tilesize
+        rect = rect.inflate(-2, -2).move(-self.left * size, -self.top * size)
+        for y in range(max(0, rect.top // size), min(self.rows, (rect.bottom - 1) // size + 1)):
+            for x in range(max(0, rect.left // size), min(self.cols, (rect.right - 1) // size + 1)):
+                self.blocked[y * self.cols + x] = 1
+
+    # Tile coordinates (in the field) of a position, or None if it's off the field
+    def tile(self,pos):
+        x = int(pos[0] // self.tilesize) - self.left
+        y = int(pos[1] // self.tilesize) - self.top
+        if 0 <= x < self.cols and 0 <= y < self.rows:
+            return (x, y)
+        return None
+
+    # Called every frame with the players position. Only does any work when the
+    # player has moved onto a new tile.
+    def update(self,pos):
+        tile = self.tile(pos)
+        if tile != self.goal:
+            self.goal = tile
+            self.build()
+
+    # The 8 tiles around a tile that can be walked to, with the cost of the step.
+    # Diagonal steps aren't allowed past the corner of a blocked tile, so mobs
+    # can't cut corners through walls.
+    def neighbours(self,x,y):
+        cols = self.cols
+        blocked = self.blocked
+        for dx, dy in ((1,0), (-1,0), (0,1), (0,-1)):
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < cols and 0 <= ny < self.rows and not blocked[ny * cols + nx]:
+                yield nx, ny, 1.0
+        for dx, dy in ((1,1), (1,-1), (-1,1), (-1,-1)):
+            nx, ny = x + dx, y + dy
+            if (0 <= nx < cols and 0 <= ny < self.rows and not blocked[ny * cols + nx]
+                    and not blocked[y * cols + nx] and not blocked[ny * cols + x]):
+                yield nx, ny, sqrt(2)
+
+    # Dijkstra outwards from the goal tile, then point every reached tile at its
+    # closest neighbour
+    def build(self):
+        self.version += 1
+        cols = self.cols
+        dist = self.dist = [-1] * (cols * self.rows)
+        dir_x = self.dir_x = [0.0] * (cols * self.rows)
+        dir_y = self.dir_y = [0.0] * (cols * self.rows)
+        if self.goal is None:
+            return
+
+        reached = []
+        queue = [(0.0, self.goal[0], self.goal[1])]
+        while queue:
+            d, x, y = heapq.heappop(queue)
+            i = y * cols + x
+            if dist[i] != -1:
+                continue
+            dist[i] = d
+            reached.append((x, y))
+            for nx, ny, cost in self.neighbours(x, y):
+                nd = d + cost
+                if dist[ny * cols + nx] == -1 and nd <= self.radius:
+                    heapq.heappush(queue, (nd, nx, ny))
+
+        for x, y in reached:
+            i = y * cols + x
+            best = dist[i]
+            step = None
+            for nx, ny, cost in self.neighbours(x, y):
+                d = dist[ny * cols + nx]
+                if d != -1 and d < best:
+                    best = d
+                    step = (nx - x, ny - y)
+            # The goal tile has nowhere better to go, mobs there just walk at the player
+            if step:
+                length = sqrt(step[0] ** 2 + step[1] ** 2)
+                dir_x[i] = step[0] / length
+                dir_y[i] = step[1] / length
+
+    # Which way a mob at pos should walk, as a unit vector, or None if the field
+    # doesn't know (off the map, out of range, or already on the players tile)
+    def direction(self,pos):
+        tile = self.tile(pos)
+        if tile is None:
+            return None
+        i = tile[1] * self.cols + tile[0]
+        if self.dir_x[i] == 0 and self.dir_y[i] == 0:
+            return None
+        return vec(self.dir_x[i], self.dir_y[i])
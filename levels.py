@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from os import path
+from settings import *
+from tilemap import TiledMap, ChunkedMap
+from mapcompiler import open_compiled
+
+# Level manager
+#
+# Game.new used to parse the .tmx file (pytmx reads the XML and loads every tile
+# image) every time a game started, and the map chunks were then rendered as the
+# camera got near them, so every restart or level change froze the game for a bit.
+#
+# Now levels are loaded by the level manager. Loading a level means parsing it and
+# rendering its map chunks (without any splats on them), and it happens in a worker
+# thread: while a level is played, the next one in LEVELS is loaded in the
+# background, so by the time it's needed it's ready to swap straight in. Loaded
+# levels are kept (the last LEVEL_CACHE used), so restarting after a game over
+# reuses the same TiledMap and chunks without loading anything.
+#
+# Everything a Level holds is only read once it's loaded, so the game can share
+# it without any locking.
+class Level:
+    def __init__(self,filename):
+        self.filename = filename
+        self.map = None
+        # Map chunks rendered ahead of time, (chunk x, chunk y) -> surface. Handed to
+        # every ChunkedMap made for this level, which never draws on them.
+        self.chunks = {}
+        # Set once the level has loaded (or failed to)
+        self.done = threading.Event()
+        self.error = None
+        # Seconds spent parsing and rendering chunks
+        self.parse_time = 0.0
+        self.prebuild_time = 0.0
+
+    def load(self):
+        try:
+            start = time.perf_counter()
+            # The compiled map (see mapcompiler.py) if there's an up to date one
+            self.map = None
+            if COMPILED_MAPS == "ON":
+                self.map = open_compiled(self.filename)
+            if self.map is None:
+                self.map = TiledMap(self.filename)
+            self.parse_time = time.perf_counter() - start
+            start = time.perf_counter()
+            self.prebuild()
+            self.prebuild_time = time.perf_counter() - start
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    # Renders map chunks nearest the players spawn first (what's on screen when the
+    # level starts), until they take up LEVEL_PREBUILD_MEMORY bytes
+    def prebuild(self):
+        chunked = ChunkedMap(self.map)
+        spawn = chunked.rect.center
+        for object in self.map.objects:
+            if object.name == 'player':
+                spawn = (object.x + object.width / 2, object.y + object.height / 2)
+
+        def distance(key):
+            center = chunked.chunk_rect(key).center
+            return (center[0] - spawn[0]) ** 2 + (center[1] - spawn[1]) ** 2
+
+        size = 0
+        for key in sorted(chunked.keys(chunked.rect), key=distance):
+            rect = chunked.chunk_rect(key)
+            size += rect.width * rect.height * 4
+            if size > LEVEL_PREBUILD_MEMORY:
+                break
+            self.chunks[key] = chunked.render(key)
+            # Let the game thread have a go between chunks
+            time.sleep(0)
+
+class LevelManager:
+    def __init__(self,folder,levels=LEVELS,cache_size=LEVEL_CACHE):
+        self.folder = folder
+        self.levels = [path.join(folder, level) for level in levels]
+        self.cache_size = cache_size
+        # Filename -> Level (loaded or still loading), least recently used first
+        self.cache = OrderedDict()
+        # Stats: levels that were already loaded when asked for, that were still
+        # loading in the background (so get had to wait), and that weren't asked for
+        # before (so get had to load them itself)
+        self.hits = 0
+        self.waits = 0
+        self.misses = 0
+
+    # Full filename of the first level
+    def first(self):
+        return self.levels[0]
+
+    # Full filename of the level after filename, or None if it's the last one
+    def following(self,filename):
+        filename = path.join(self.folder, filename)
+        if filename in self.levels:
+            i = self.levels.index(filename) + 1
+            if i < len(self.levels):
+                return self.levels[i]
+        return None
+
+    # Starts loading a level in a worker thread, unless it's loaded or loading already
+    def preload(self,filename):
+        filename = path.join(self.folder, filename)
+        level = self.cache.get(filename)
+        if level is None:
+            level = self.cache[filename] = Level(filename)
+            threading.Thread(target=level.load, daemon=True).start()
+        self.cache.move_to_end(filename)
+        self.trim()
+        return level
+
+    # True if a level is loaded and get would return it straight away
+    def ready(self,filename):
+        level = self.cache.get(path.join(self.folder, filename))
+        return level is not None and level.done.is_set()
+
+    # Gets a loaded level. If it's still loading in the background this waits for
+    # it, and if nobody asked for it before it's loaded right here.
+    def get(self,filename):
+        filename = path.join(self.folder, filename)
+        level = self.cache.get(filename)
+        if level is None:
+            self.misses += 1
+            level = self.cache[filename] = Level(filename)
+            level.load()
+        elif level.done.is_set():
+            self.hits += 1
+        else:
+            self.waits += 1
+            level.done.wait()
+        if level.error:
+            # Don't keep the broken level, so it's tried again next time
+            del self.cache[filename]
+            raise level.error
+        self.cache.move_to_end(filename)
+        self.trim()
+        return level
+
+    # Forgets the least recently used levels past cache_size (not ones still loading)
+    def trim(self):
+        for filename in list(self.cache):
+            if len(self.cache) <= self.cache_size:
+                break
+            if self.cache[filename].done.is_set():
+                del self.cache[filename]
+
+    def report(self):
+        lines = ["levels: {} reused, {} waited for, {} loaded on the spot".format(
+                 self.hits, self.waits, self.misses)]
+        for level in self.cache.values():
+            if level.done.is_set() and level.map:
+                lines.append("  {}: {} in {:.0f} ms, {} chunks prebuilt in {:.0f} ms".format(
+                             path.basename(level.filename),
+                             "parsed" if isinstance(level.map, TiledMap) else "compiled map loaded",
+                             level.parse_time * 1000,
+                             len(level.chunks), level.prebuild_time * 1000))
+        return lines
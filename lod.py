@@ -0,0 +1,146 @@
+import time
+from settings import *
+
+# Mob level of detail (LOD = "ON" in settings.py)
+#
+# Every Mob.update steers along the flow field, pushes away from the mobs around
+# it, turns its image and does two wall collision passes, every tick, even when
+# the mob is nowhere near the screen. The scheduler sorts the mobs into tiers
+# every LOD_REFRESH ticks and only gives each one as much work as it needs:
+#
+#   on screen - within LOD_SCREEN_MARGIN pixels of the screen: the full update,
+#               every tick
+#   near      - off the screen, but within DETECT_RADIUS of the player (so it's
+#               chasing the player): Mob.update_far every LOD_NEAR_INTERVAL ticks, one
+#               big step with no separation and no turning of the image. A
+#               different slice of the near mobs gets its turn each tick, so the
+#               work is spread out evenly.
+#   dormant   - further away than that: asleep (a full update wouldn't move it
+#               anyway). It only checks whether it's been shot dead, when the
+#               tiers are sorted.
+#
+# The tiers only depend on the game state (the camera as the last update left
+# it, not as it was drawn), so replays play out the same at any frame rate.
+#
+# With LOD on, Game.update_sprites leaves the mobs to the scheduler. Only awake
+# mobs go in the mob grid (separation), and only mobs on the screen are checked
+# for touching the player, so sleeping mobs cost next to nothing per tick.
+ON_SCREEN, NEAR, DORMANT = 0, 1, 2
+TIER_NAMES = ['on screen', 'near', 'dormant']
+
+class LODScheduler:
+    def __init__(self,game):
+        self.game = game
+        self.tick = 0
+        # The mobs in each tier, as of the last time they were sorted
+        self.tiers = [[], [], []]
+        # mob -> which of the LOD_NEAR_INTERVAL ticks it gets its turn on when it's near
+        self.phases = {}
+        self.next_phase = 0
+        # Stats: mob ticks spent in each tier, updates done (full and far), and
+        # seconds spent on each tier and on sorting (not counting the dormant checks)
+        self.counts = [0, 0, 0]
+        self.full_updates = 0
+        self.far_updates = 0
+        self.times = [0.0, 0.0, 0.0]
+        self.sort_time = 0.0
+
+    # Sorts every mob into its tier
+    def sort(self):
+        game = self.game
+        view = game.camera.sim_viewport().inflate(LOD_SCREEN_MARGIN * 2, LOD_SCREEN_MARGIN * 2)
+        px, py = game.player.pos
+        radius = DETECT_RADIUS ** 2
+        tiers = [[], [], []]
+        for mob in game.mobs:
+            if view.colliderect(mob.rect):
+                tiers[ON_SCREEN].append(mob)
+            else:
+                x, y = mob.pos
+                if (x - px) ** 2 + (y - py) ** 2 < radius:
+                    tiers[NEAR].append(mob)
+                else:
+                    tiers[DORMANT].append(mob)
+            if mob not in self.phases:
+                self.phases[mob] = self.next_phase
+                self.next_phase = (self.next_phase + 1) % LOD_NEAR_INTERVAL
+        # Forget mobs that have died
+        if len(self.phases) > len(game.mobs):
+            self.phases = dict((mob, self.phases[mob]) for mob in game.mobs)
+        self.tiers = tiers
+
+        start = time.perf_counter()
+        for mob in tiers[DORMANT]:
+            mob.check_health()
+        self.times[DORMANT] += time.perf_counter() - start
+
+    # Updates the mobs. Called once every tick, instead of each mob's update.
+    def update(self):
+        if self.tick % LOD_REFRESH == 0:
+            start = time.perf_counter()
+            dormant = self.times[DORMANT]
+            self.sort()
+            self.sort_time += time.perf_counter() - start - (self.times[DORMANT] - dormant)
+        tick = self.tick
+        self.tick += 1
+        # (Mobs that die after the tiers were sorted are skipped, and mobs made
+        # since then wait for the next sort)
+        start = time.perf_counter()
+        for mob in self.tiers[ON_SCREEN]:
+            if mob.alive():
+                mob.update()
+                self.full_updates += 1
+        self.counts[ON_SCREEN] += len(self.tiers[ON_SCREEN])
+        near = time.perf_counter()
+
+        interval = LOD_NEAR_INTERVAL
+        dt = self.game.dt * interval
+        phases = self.phases
+        for mob in self.tiers[NEAR]:
+            if mob.alive():
+                if (tick + phases[mob]) % interval == 0:
+                    mob.update_far(dt)
+                    self.far_updates += 1
+                else:
+                    mob.check_health()
+        self.counts[NEAR] += len(self.tiers[NEAR])
+        self.counts[DORMANT] += len(self.tiers[DORMANT])
+        end = time.perf_counter()
+
+        self.times[ON_SCREEN] += near - start
+        self.times[NEAR] += end - near
+
+    # Mobs in each tier right now
+    def populations(self):
+        return [len(tier) for tier in self.tiers]
+
+    # Mobs on the screen or near it. Only these steer, so only these need to be in
+    # the mob grid.
+    def awake(self):
+        return [mob for mob in self.tiers[ON_SCREEN] + self.tiers[NEAR] if mob.alive()]
+
+    # Mobs on the screen, the only ones close enough to be touching the player
+    def on_screen(self):
+        return [mob for mob in self.tiers[ON_SCREEN] if mob.alive()]
+
+    # Estimated seconds saved so far, and what the mobs would have taken without
+    # LOD: every near and dormant mob tick costing as much as a full update of a
+    # mob on the screen did. (That's a bit high for dormant mobs, which wouldn't
+    # have moved, but timing real updates of them would change the game.)
+    def saved(self):
+        full = self.times[ON_SCREEN] / self.full_updates if self.full_updates else 0.0
+        without = self.times[ON_SCREEN] + (self.counts[NEAR] + self.counts[DORMANT]) * full
+        spent = sum(self.times) + self.sort_time
+        return without - spent, without
+
+    def report(self):
+        ticks = max(1, self.tick)
+        saved, without = self.saved()
+        return ["lod: mobs per tick - " + ", ".join("{} {:.1f}".format(name, count / ticks)
+                                                    for name, count in zip(TIER_NAMES, self.counts)),
+                "  {} full updates ({:.1f} ms), {} far updates ({:.1f} ms), dormant checks {:.1f} ms, "
+                "sorting {:.1f} ms".format(self.full_updates, self.times[ON_SCREEN] * 1000,
+                                           self.far_updates, self.times[NEAR] * 1000,
+                                           self.times[DORMANT] * 1000, self.sort_time * 1000),
+                "  about {:.1f} ms saved, {:.0%} of the {:.1f} ms the mobs would have taken".format(
+                    saved * 1000, saved / without if without else 0, without * 1000)]
@@ -19,6 +19,7 @@
 '''
 
 
+import os
 import pygame as pg ## pygame == pg important..
 import random
 import time
@@ -26,6 +27,19 @@ from settings import *
 from os import path
 from sprites import *
 from tilemap import *
+from spatial import SpatialHash, WallIndex
+from mobengine import MobEngine, HAVE_NUMPY
+from bulletpool import BulletPool
+from cache import RotationCache, TextCache
+from renderer import DirtyRenderer, RenderLists
+from sound import SoundManager, VoiceManager
+from assetpack import open_pack, load_images, sound_files
+from flowfield import FlowField
+from profiler import Profiler
+from replay import LiveInput, Recorder, INPUT_STATES
+from levels import LevelManager
+from world import World
+from lod import LODScheduler
 
 # HUD Function
 # Function to draw player health onto screen. Will be called within
@@ -49,16 +63,30 @@ def draw_player_health(surf, x,y, percent):
     pg.draw.rect(surf,WHITE,outline_rect,2)
 
 class Game:
-    def __init__(self):
-        # Initialize pygame, pg sounds & game window, etc
-        pg.mixer.pre_init(44100, -16, 4, 2048)
-        pg.init()
-        pg.mixer.init()
+    def __init__(self,headless=False):
+        # Headless mode: no window and no sound. SDL's "dummy" drivers give us a
+        # display surface that only lives in memory, so everything (including
+        # draw()) still works. Used for benchmarks and servers.
+        self.headless = headless
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+            pg.init()
+            pg.mixer.quit()
+        else:
+            # Initialize pygame, pg sounds & game window, etc
+            pg.mixer.pre_init(44100, -16, 4, 2048)
+            pg.init()
+            pg.mixer.init()
         self.screen = pg.display.set_mode((WIDTH, HEIGHT))
         pg.display.set_caption(TITLE)
 
         # Starts a timer - used to record events
         self.clock = pg.time.Clock()
+        # Times every part of every frame (see profiler.py)
+        self.profiler = Profiler(PROFILER == "ON")
+        # Where the players input comes from each tick (a Replay swaps this out)
+        self.input_source = LiveInput()
 
         # pg.key.set_repeat(500,100) # Keyboard repeating function, (time key is held, time between repeats)
         # Ensures game remains running until set otherwise
@@ -71,84 +99,137 @@ class Game:
         # Assets folder initalization
         img_folder = path.join(game_folder, 'img')
         self.map_folder = path.join(game_folder, 'maps')
-        snd_folder = path.join(game_folder, 'snd')
+        # Maps are parsed and rendered in the background by the level manager. The
+        # first level starts loading now, while the rest of the assets load.
+        self.levels = LevelManager(self.map_folder)
+        if WORLD_MODE == "OFF":
+            self.levels.preload(self.levels.first())
+        self.snd_folder = path.join(game_folder, 'snd')
         music_folder = path.join(game_folder, 'music')
 
         # Fonts
         self.title_font = path.join(img_folder, 'ZOMBIE.TTF')
         self.hud_font = path.join(img_folder, 'Impacted2.0.ttf')
+        # Fonts and text that has already been rendered, for draw_text
+        self.text_cache = TextCache()
 
         # Image to dim the screen
         self.dim_screen = pg.Surface(self.screen.get_size()).convert_alpha()
         # Black, with alpha channel of 180
         self.dim_screen.fill((0,0,0,180))
 
+        # Every image, already scaled to the size it's used at. Comes from the asset pack
+        # if there's an up to date one, otherwise from the files in img/
+        self.pack = open_pack(path.join(game_folder, ASSET_PACK))
+        if self.pack:
+            images = self.pack.images()
+        else:
+            images = load_images()
+
         # Player image variable initalization
         # PLAYER_IMG is specified in the constants in settings.py
-        self.player_img = pg.image.load(path.join(img_folder, PLAYER_IMG)).convert_alpha()
-        self.wall_img = pg.image.load(path.join(img_folder, WALL_IMG)).convert_alpha()
-        self.mob_img = pg.image.load(path.join(img_folder, MOB_IMG)).convert_alpha()
+        self.player_img = images['player']
+        self.wall_img = images['wall']
+        self.mob_img = images['mob']
+        # Rotated versions of the player and mob images, made as they're needed
+        self.player_rotations = RotationCache(self.player_img)
+        # Red tinted player (shown when hurt, see Player.update)
+        damaged = self.player_img.copy()
+        damaged.fill((255,0,0,255), special_flags = pg.BLEND_RGBA_MULT)
+        self.player_damage_rotations = RotationCache(damaged)
+        self.mob_rotations = RotationCache(self.mob_img)
         self.bullet_images = {}
-        self.bullet_images['lg'] = pg.image.load(path.join(img_folder, BULLET_IMG)).convert_alpha()
-        # Take the normal bullet image and scale it down to get smaller bullet images
-        self.bullet_images['sm'] = pg.transform.scale(self.bullet_images['lg'], (10,10))
-        self.splat = pg.image.load(path.join(img_folder, MOB_DEATH)).convert_alpha()
-        self.splat = pg.transform.scale(self.splat,(64,64))
+        self.bullet_images['lg'] = images['bullet_lg']
+        # Smaller version of the normal bullet image (scaled down to 10x10)
+        self.bullet_images['sm'] = images['bullet_sm']
+        self.splat = images['splat']
 
         # List to store the animation pictures for gun muzzle
         self.gun_flashes = []
         # List to store the images for the items (e.g health_pack)
         self.item_images = {}
         # For each image in the list, append them to self.gun_flashes
-        for img in MUZZLE_FLASHES:
-            self.gun_flashes.append(pg.image.load(path.join(img_folder, img)).convert_alpha())
+        for i in range(len(MUZZLE_FLASHES)):
+            self.gun_flashes.append(images['flash_%d' % i])
         for item in ITEM_IMAGES:
-            self.item_images[item] = pg.image.load(path.join(img_folder, ITEM_IMAGES[item])).convert_alpha()
+            self.item_images[item] = images['item_' + item]
 
         # Lighting effects (fog of war)
         self.fog = pg.Surface((WIDTH,HEIGHT))
         self.fog.fill(NIGHT_COLOR)
-        self.light_mask = pg.image.load(path.join(img_folder, LIGHT_MASK)).convert_alpha()
-        self.light_mask = pg.transform.scale(self.light_mask, LIGHT_RADIUS)
+        self.light_mask = images['light_mask']
         self.light_rect = self.light_mask.get_rect()
-
-        # Resize wall_img to match the wall size (tilesize)
-        self.wall_img = pg.transform.scale(self.wall_img, (TILESIZE, TILESIZE))
+        # The fog with a light in it never changes, so bake it once: the night colour
+        # with the light gradient on top. Muzzle flashes get a smaller one.
+        self.light_patch = self.bake_light(self.light_mask)
+        self.flash_light_patch = self.bake_light(pg.transform.scale(self.light_mask, MUZZLE_LIGHT_RADIUS))
+        # Plain night colour everywhere, for the parts of the screen no light reaches
+        self.night_fog = pg.Surface((WIDTH, HEIGHT))
+        self.night_fog.fill(NIGHT_COLOR)
 
         # All sound loading
-        pg.mixer.music.load(path.join(music_folder, BG_MUSIC))
-        self.effects_sounds = {}
-        for sound in EFFECTS_SOUNDS:
-            self.effects_sounds[sound] = pg.mixer.Sound(path.join(snd_folder, EFFECTS_SOUNDS[sound]))
-        self.weapon_sounds = {}
-        self.weapon_sounds['gun'] = []
+        if not self.headless:
+            pg.mixer.music.load(path.join(music_folder, BG_MUSIC))
+        # Sound effects are loaded when they're first played (see SoundManager). Here we
+        # only set the volumes, and start loading them in the background
+        self.sounds = SoundManager(self.snd_folder, self.pack, enabled = not self.headless)
         for weapon in WEAPON_SOUNDS:
-            self.weapon_sounds[weapon] = []
             for snd in WEAPON_SOUNDS[weapon]:
-                s = pg.mixer.Sound(path.join(snd_folder,snd))
-                s.set_volume(.3)
-                self.weapon_sounds[weapon].append(s)
-        self.zombie_moan_sounds = []
+                self.sounds.set_volume(snd, .3)
         for snd in ZOMBIE_MOAN_SOUNDS:
-            s = pg.mixer.Sound(path.join(snd_folder, snd))
-            s.set_volume(0.15)
-            self.zombie_moan_sounds.append(s)
-        self.player_hit_sounds = []
-        for snd in PLAYER_HIT_SOUNDS:
-            self.player_hit_sounds.append(pg.mixer.Sound(path.join(snd_folder, snd)))
-        self.zombie_hit_sounds = []
-        for snd in ZOMBIE_HIT_SOUNDS:
-            self.zombie_hit_sounds.append(pg.mixer.Sound(path.join(snd_folder, snd)))
-
+            self.sounds.set_volume(snd, 0.15)
+        if SOUND_PRELOAD == "ON":
+            self.sounds.preload(sound_files())
+        # Every sound is played through the voice manager, which shares out the mixer channels
+        self.voices = VoiceManager(self, self.sounds)
+
+    # Fog with a light in it, ready to be multiplied onto the screen
+    def bake_light(self,mask):
+        patch = pg.Surface(mask.get_size())
+        patch.fill(NIGHT_COLOR)
+        patch.blit(mask, (0,0))
+        return patch
 
     # Quit function
     def quit(self):
+        self.save_recording()
+        if self.profiler.frames:
+            self.profiler.dump(PROFILE_DUMP)
+        if DEBUG_MODE == "ON":
+            print("\n".join(self.sounds.report()))
+            print("\n".join(self.levels.report()))
+            if self.world:
+                print("\n".join(self.world.report()))
+            if self.lod:
+                print("\n".join(self.lod.report()))
+            print("voices: {} played, {} deduplicated, {} stolen, {} dropped".format(
+                self.voices.played, self.voices.deduped, self.voices.stolen, self.voices.dropped))
         pg.quit()
         quit()
 
-    # Called to initalize the game
-    def new(self):
+    # Called to initalize the game. map_file is the .tmx map to play, the first level
+    # if not given.
+    # Everything random in the game comes from seed, so the same seed, map and input
+    # always play out the same (see replay.py). A new seed is picked if not given.
+    def new(self,map_file=None,seed=None):
+        if seed is None:
+            seed = random.randrange(2 ** 63)
+        self.seed = seed
+        random.seed(seed)
+        # Every mob in this game moves at the same speed
+        self.mob_speed = random.choice(MOB_SPEEDS)
+        self.input = INPUT_STATES[0]
+        if RECORD_INPUT == "ON":
+            self.recorder = Recorder(seed, map_file or '')
+        else:
+            self.recorder = None
+
         self.paused = False
+        # Game clock (milliseconds of game time) and the interpolation state
+        self.sim_time = 0
+        self.alpha = 1.0
+        self.prev_centers = {}
+        self.prev_camera = (0,0)
 
         # Initalizes the all_sprites and walls group
         self.all_sprites = pg.sprite.LayeredUpdates()
@@ -156,11 +237,51 @@ class Game:
         self.mobs = pg.sprite.Group()
         self.bullets = pg.sprite.Group()
         self.items = pg.sprite.Group()
+        self.flashes = pg.sprite.Group()
+
+        # Spatial hash of all the mobs, so mobs can find their neighbours quickly
+        # Cells are AVOID_RADIUS big, so every mob within AVOID_RADIUS is in the
+        # 3x3 cells around a mob
+        self.mob_grid = SpatialHash(AVOID_RADIUS)
+
+        # With BATCHED_MOBS on, the mob engine moves every mob at once and the
+        # mobs are BatchedMobs, which just read their state from the engine
+        if BATCHED_MOBS == "ON" and HAVE_NUMPY:
+            self.mob_engine = MobEngine(self)
+            self.mob_class = BatchedMob
+        else:
+            self.mob_engine = None
+            self.mob_class = Mob
 
-        # Initalizing the TiledMap
-        self.map = TiledMap(path.join(self.map_folder, 'level1.tmx'))
-        self.map_img = self.map.make_map()
-        self.map_rect = self.map_img.get_rect()
+        # Off screen mobs get updated less (or not at all), see lod.py
+        if LOD == "ON":
+            self.lod = LODScheduler(self)
+        else:
+            self.lod = None
+
+        # Bullets come out of a pool of reusable bullets (if numpy is installed)
+        if BULLET_POOL == "ON" and HAVE_NUMPY:
+            self.bullet_pool = BulletPool(self)
+        else:
+            self.bullet_pool = None
+
+        if WORLD_MODE == "ON":
+            # Endless procedural world, made from the seed around the camera as it goes
+            self.world = World(self, seed)
+            self.level_file = None
+            self.map = self.world
+            self.map_chunks = ChunkedMap(self.map)
+        else:
+            self.world = None
+            # Initalizing the TiledMap. The level manager has usually parsed it already
+            # (in the background, or for the last game on this level).
+            self.level_file = map_file or self.levels.first()
+            level = self.levels.get(self.level_file)
+            self.map = level.map
+            # The map is rendered in chunks as the camera gets near them, starting with
+            # the ones the level manager rendered ahead of time
+            self.map_chunks = ChunkedMap(self.map, prebuilt = level.chunks)
+        self.map_rect = self.map_chunks.rect
 
         # # Enumerate takes item AND index number <=== IMPORTANT!
         # for row, tiles in enumerate(self.map.data):
@@ -177,7 +298,7 @@ class Game:
         #         # If tile is M, spawn a Player sprite at the x and y coordinates
         #         if tile == 'M':
         #             Mob(self,col,row)
-        for object in self.map.tmxdata.objects:
+        for object in self.map.objects:
             obj_center = vec(object.x + object.width/2,
                             object.y + object.height/2)
             if object.name == 'player':
@@ -185,55 +306,219 @@ class Game:
             if object.name == 'wall':
                 Obstacle(self,object.x,object.y,object.width,object.height)
             if object.name == 'zombie':
-                Mob(self, obj_center, obj_center)
+                self.mob_class(self, obj_center.x, obj_center.y)
             if object.name in ['health','shotgun']:
                 Item(self,obj_center, object.name)
 
+        # Walls never move from here on, so index them once for fast wall collisions
+        self.wall_index = WallIndex(self.walls, TILESIZE)
+        # One flow field (shared by every mob) that leads to the player around walls.
+        # (The endless world makes its own over the regions it has loaded)
+        if not self.world:
+            self.flow_field = FlowField(self.walls, self.map.width, self.map.height,
+                                        blocked = self.map.blocked())
+
         # self.player = Player(self,5,5)
         # Initalize the camera
         self.camera = Camera(self.map.width,self.map.height)
-        self.effects_sounds['level_start'].play()
+        if self.world:
+            # Load the regions around the player
+            self.camera.update(self.player)
+            self.world.update()
+        else:
+            # Start loading the next level while this one is played
+            next_level = self.levels.following(self.level_file)
+            if next_level:
+                self.levels.preload(next_level)
+        self.voices.play('effects', EFFECTS_SOUNDS['level_start'], 3)
         if DEBUG_LIGHT == "ON":
             self.night = False
         else:
             self.night = True
 
+        # Alert of debug_mode is off
+        if DEBUG_MODE == "OFF" and not self.headless:
+            print("DEBUG MODE OFF")
+
+        # Lists of the sprites on screen, made once every frame
+        self.render_lists = RenderLists(self)
+
+        # Optional renderer that only redraws what changed
+        if DIRTY_RECTS == "ON":
+            self.renderer = DirtyRenderer(self)
+        else:
+            self.renderer = None
+
     # >> Game Loop << Keeps running while self.playing = True
     def run(self):
         # Game Loop
         self.playing = True
 
         # Infinitely looping BG music
-        pg.mixer.music.play(loops=-1)
+        if not self.headless:
+            pg.mixer.music.play(loops=-1)
+        # Fixed timestep: the game is always updated in steps of exactly dt seconds.
+        # Real time since the last frame is added to the accumulator, and we run as
+        # many whole steps as fit in it. What's left over (less than a step) is used to
+        # draw sprites part of the way between the last two steps (see sprite_rect).
+        self.dt = 1 / SIM_RATE
+        accumulator = 0.0
         while self.playing:
 
-            # Delta time, difference in time, in seconds.
-            self.dt = self.clock.tick(FPS)/1000
+            # Real time since the last frame, in seconds.
+            accumulator += self.clock.tick(FPS)/1000
+            self.profiler.begin_frame()
             self.events()
-            if not self.paused:
-                self.update()
+
+            steps = int(accumulator // self.dt)
+            if steps > MAX_CATCHUP_STEPS:
+                # We're too far behind (e.g. the window was dragged), skip the rest
+                steps = MAX_CATCHUP_STEPS
+                accumulator %= self.dt
+            else:
+                accumulator -= steps * self.dt
+            for i in range(steps):
+                if not self.paused:
+                    # Only the positions before the last step are needed for drawing
+                    self.step(snapshot = i == steps - 1)
+            # How far we are between the last step and the next one (nothing moves while paused)
+            self.alpha = 1.0 if self.paused else accumulator / self.dt
             self.draw()
+            self.profiler.end_frame()
+        self.save_recording()
+
+    # Writes out the recording of this game, if we're recording
+    def save_recording(self):
+        if self.recorder:
+            self.recorder.save(REPLAY_FILE, self)
+            self.recorder = None
+
+    # Runs the game without a window or the frame rate limit (headless mode).
+    # Every frame is exactly dt seconds long, no matter how long it really took.
+    # Stops after `frames` frames, or when the game ends. Returns how many frames
+    # were run and how many seconds that took.
+    def run_headless(self,frames,draw=False,dt=1/SIM_RATE):
+        self.playing = True
+        self.dt = dt
+        # Always draw exactly where things are, no interpolation
+        self.alpha = 1.0
+        start = time.perf_counter()
+        count = 0
+        while self.playing and count < frames:
+            self.profiler.begin_frame()
+            self.events()
+            if not self.paused:
+                self.step()
+            if draw:
+                self.draw()
+            self.profiler.end_frame()
+            count += 1
+        return count, time.perf_counter() - start
+
+    # One fixed step of the game. If snapshot is True, remember where every sprite
+    # and the camera were first, so draw can interpolate between then and now.
+    def step(self,snapshot=False):
+        if snapshot:
+            self.prev_centers = {sprite: sprite.rect.center for sprite in self.all_sprites}
+            self.prev_camera = self.camera.offset
+        self.input = self.input_source.poll()
+        self.update()
+        # Game time in milliseconds, used instead of pg.time.get_ticks() so the
+        # game runs the same no matter how fast it's really running
+        self.sim_time += self.dt * 1000
+        self.input_source.after_tick(self)
+        if self.recorder:
+            self.recorder.tick(self, self.input)
+
+    # Screen rect to draw a sprite at. Between game steps (alpha < 1) sprites are
+    # drawn part of the way from where they were before the last step to where
+    # they are now, so movement looks smooth whatever the update rate.
+    def sprite_rect(self,sprite):
+        rect = self.camera.apply(sprite)
+        if self.alpha < 1:
+            prev = self.prev_centers.get(sprite)
+            if prev:
+                back = 1 - self.alpha
+                rect.move_ip(round((prev[0] - sprite.rect.centerx) * back),
+                             round((prev[1] - sprite.rect.centery) * back))
+        return rect
 
     # Updates all groups every frame per second
     def update(self):
+        # New frame, so any sound can be played again (see VoiceManager)
+        self.voices.end_frame()
 
         # Check if the game is over. The condition for game over is when there
-        # are no mobs left.
-        if len(self.mobs) == 0:
+        # are no mobs left. (The endless world never runs out)
+        if len(self.mobs) == 0 and not self.world:
             self.playing = False
 
-        # Alert of debug_mode is off
-        if DEBUG_MODE == "OFF":
-            print("DEBUG MODE OFF")
+        profile = self.profiler.section
+
+        # Re-point the flow field if the player moved onto another tile
+        with profile('flow field'):
+            self.flow_field.update(self.player.pos)
+
+        if self.mob_engine:
+            # Move the whole horde in one go, the mob sprites then just catch up
+            with profile('mob engine'):
+                self.mob_engine.update(self.dt)
+        else:
+            # Rebuild the mob spatial hash once per frame, before any mob steers
+            with profile('mob grid'):
+                self.mob_grid.rebuild(self.lod.awake() if self.lod else self.mobs)
+
+        # Move every pooled bullet at once
+        if self.bullet_pool:
+            with profile('bullet pool'):
+                self.bullet_pool.update(self.dt)
 
         # Game Loop - Update
-        self.all_sprites.update()
+        self.update_sprites()
+        self.wall_index.end_frame()
 
         # In every frame, update the camera to match the players offset.
         # THIS IS AMAZING! The camera sprite will follow whatever sprite you command
         # it to follow! In this case, we require the map to move with the camera.
         self.camera.update(self.player)
 
+        # Load the world around the camera, and unload what it's left behind
+        if self.world:
+            with profile('world'):
+                self.world.update()
+
+        with profile('collisions'):
+            self.collide()
+
+    # Updates every sprite, in the same order as all_sprites.update(). When profiling,
+    # every run of sprites of the same class is timed as 'update <class name>'.
+    # With LOD on, the LOD scheduler updates the mobs first, and they're skipped here.
+    def update_sprites(self):
+        sprites = self.all_sprites.sprites()
+        if self.lod:
+            with self.profiler.section('lod'):
+                self.lod.update()
+            sprites = [sprite for sprite in sprites if not isinstance(sprite, Mob)]
+        if not self.profiler.enabled:
+            for sprite in sprites:
+                sprite.update()
+            return
+        run = []
+        for sprite in sprites:
+            if run and type(sprite) is not type(run[0]):
+                self.update_run(run)
+                run = []
+            run.append(sprite)
+        if run:
+            self.update_run(run)
+
+    def update_run(self,sprites):
+        with self.profiler.section('update ' + type(sprites[0]).__name__):
+            for sprite in sprites:
+                sprite.update()
+
+    # Collisions between the player, items, mobs and bullets
+    def collide(self):
         # Player hits items
         hits = pg.sprite.spritecollide(self.player, self.items, False)
         for hit in hits:
@@ -241,17 +526,19 @@ class Game:
             # kill the sprite, and add (HEALTH_PACK_AMOUNT) to the players health (this is a function)
             if hit.type == 'health' and self.player.health < PLAYER_HEALTH:
                 hit.kill()
-                self.effects_sounds['health_up'].play()
+                self.voices.play('effects', EFFECTS_SOUNDS['health_up'], 3)
                 self.player.add_health(HEALTH_PACK_AMOUNT)
             if hit.type == 'shotgun':
                 hit.kill()
-                self.effects_sounds['gun_pickup'].play()
+                self.voices.play('effects', EFFECTS_SOUNDS['gun_pickup'], 3)
                 self.player.weapon = 'shotgun'
 
 
 
         # If mobs hit player
-        hits = pg.sprite.spritecollide(self.player, self.mobs, False, collide_hit_rect)
+        # (With LOD on, only the mobs on the screen can be close enough)
+        mobs = self.lod.on_screen() if self.lod else self.mobs
+        hits = pg.sprite.spritecollide(self.player, mobs, False, collide_hit_rect)
         for hit in hits:
             self.player.health -= MOB_DAMAGE
             hit.vel = vec(0,0)
@@ -267,12 +554,15 @@ class Game:
             self.player.pos += vec(MOB_KNOCKBACK,0).rotate(-hits[0].rot)
 
         # If bullets hit a mob
-        hits = pg.sprite.groupcollide(self.mobs, self.bullets, False, True)
+        if self.bullet_pool:
+            hits = self.bullet_pool.collide_mobs(self.mobs)
+        else:
+            hits = collide_bullets(self.mobs, self.bullets)
 
         # 50% chance of a sound occuring in the event of the mob hitting a player
         for mob in hits:
             if random.random() < 0.5:
-                random.choice(self.player_hit_sounds).play()
+                self.voices.play('player', random.choice(PLAYER_HIT_SOUNDS), 2)
 
             # Remove BULLET_DAMAGE health from the mobs health
             #hit.health -= WEAPONS[self.player.weapon]['damage'] * len(hits[hit])
@@ -286,8 +576,10 @@ class Game:
     def events(self):
 
         # Game Loop - Events
+        with self.profiler.section('events'):
+            events = pg.event.get()
 
-        for event in pg.event.get():
+        for event in events:
 
             # Check for closing window
             if event.type == pg.QUIT:
@@ -297,6 +589,9 @@ class Game:
             if event.type == pg.KEYDOWN:
                 if event.key == pg.K_ESCAPE:
                     self.paused = not self.paused
+                # F3 shows/hides the profiler overlay
+                if event.key == pg.K_F3:
+                    self.profiler.toggle_overlay()
 
     # Function to draw gridmap for game window
     def draw_grid(self):
@@ -307,27 +602,108 @@ class Game:
         for y in range(0,HEIGHT,TILESIZE):
             pg.draw.line(self.screen, LIGHTGREY,(0,y),(WIDTH,y))
 
-    def render_fog(self):
-        # draw the light mask (gradient) onto fog image
-        # Fog colour
-        self.fog.fill(NIGHT_COLOR)
-        self.light_rect.center = self.camera.apply(self.player).center
-        # Apply light gradient
-        self.fog.blit(self.light_mask, self.light_rect)
-        self.screen.blit(self.fog,(0,0),special_flags = pg.BLEND_MULT)
+    # Every light on the screen this frame, as a list of (baked light, screen rect).
+    # The player carries a light, and every muzzle flash lights up the area around it.
+    def lights(self):
+        self.light_rect.center = self.sprite_rect(self.player).center
+        lights = [(self.light_patch, self.light_rect.copy())]
+        for flash in self.flashes:
+            rect = self.flash_light_patch.get_rect()
+            rect.center = self.sprite_rect(flash).center
+            lights.append((self.flash_light_patch, rect))
+        return lights
+
+    # Darkens the screen, except around lights.
+    #
+    # Instead of filling a full screen fog surface and multiplying the whole thing
+    # onto the screen every frame, only the area around the lights (region) uses
+    # the baked light images. Everything outside it is just the night colour, which
+    # is multiplied on straight from night_fog, so nothing gets redrawn per frame.
+    # When lights overlap they're combined by keeping the brightest of each pixel.
+    #
+    # If areas (a list of screen rects) is given, only those parts of the screen get
+    # darkened (DirtyRenderer).
+    def render_fog(self,areas=None,lights=None):
+        if lights is None:
+            lights = self.lights()
+        screen_rect = self.screen.get_rect()
+        region = lights[0][1].unionall([rect for patch, rect in lights[1:]]).clip(screen_rect)
+
+        if len(lights) == 1:
+            # Just the players light, use the baked patch as it is
+            glow, glow_pos, glow_area = lights[0][0], lights[0][1], None
+        else:
+            # Combine the lights in the fog surface, only inside region
+            self.fog.fill(NIGHT_COLOR, region)
+            for patch, rect in lights:
+                self.fog.blit(patch, rect, special_flags = pg.BLEND_RGB_MAX)
+            glow, glow_pos, glow_area = self.fog, region, region
+
+        # The parts of the screen around region that no light reaches
+        if region.width and region.height:
+            dark = [pg.Rect(0, 0, screen_rect.width, region.top),
+                    pg.Rect(0, region.bottom, screen_rect.width, screen_rect.height - region.bottom),
+                    pg.Rect(0, region.top, region.left, region.height),
+                    pg.Rect(region.right, region.top, screen_rect.width - region.right, region.height)]
+        else:
+            dark = [screen_rect]
+            glow = None
+
+        for area in areas or [None]:
+            self.screen.set_clip(area)
+            for rect in dark:
+                if rect.width > 0 and rect.height > 0:
+                    self.screen.blit(self.night_fog, rect, rect, special_flags = pg.BLEND_MULT)
+            if glow:
+                self.screen.blit(glow, glow_pos, glow_area, special_flags = pg.BLEND_MULT)
+        self.screen.set_clip(None)
 
     # Blits and draws all stuff to screen
     def draw(self):
         # Makes the program title an fps counter if debugmode is on
         if DEBUG_MODE == "ON":
-            pg.display.set_caption("{:.2f}".format(self.clock.get_fps()))
+            pg.display.set_caption("{:.2f} - wall checks saved: {} - text cache: {} hits, {} misses - sprites: {} drawn, {} culled".format(
+                                   self.clock.get_fps(), self.wall_index.checks_saved,
+                                   self.text_cache.hits, self.text_cache.misses,
+                                   self.render_lists.drawn, self.render_lists.culled))
+        self.map_chunks.begin_frame()
+
+        # Draw the camera part of the way between the last two game steps, or right
+        # where it is (while paused, the last frame may have left it part of the way)
+        if self.alpha < 1:
+            self.camera.interpolate(self.prev_camera, self.alpha)
+        else:
+            self.camera.camera = pg.Rect(*self.camera.offset, self.camera.width, self.camera.height)
+
+        # Work out which sprites are on screen, and where
+        with self.profiler.section('cull'):
+            self.render_lists.collect()
+
+        # The dirty rect renderer only redraws the parts of the screen that changed
+        if self.renderer:
+            self.renderer.draw()
+            return
+
+        profile = self.profiler.section
+        self.draw_world()
+        self.draw_hud()
+        with profile('flip'):
+            pg.display.flip()
+
+    # Draws everything that goes over the top of the sprites (the mobs health bars)
+    def draw_overlays(self):
+        for col, rect in self.render_lists.bars:
+            self.screen.fill(col, rect)
+
+    # Draws the map, sprites and the fog
+    def draw_world(self):
+        profile = self.profiler.section
         # self.screen.fill(BGCOLOR)
-        self.screen.blit(self.map_img, self.camera.apply_rect(self.map_rect))
-        for sprite in self.all_sprites:
-            if isinstance(sprite, Mob):
-                sprite.draw_health()
-            # Draws an outline on the hitbox of all sprite rectangles if debugmode is on
-            if DEBUG_MODE == "ON":
+        with profile('map'):
+            self.map_chunks.draw(self.screen, self.camera)
+        # Draws an outline on the hitbox of all sprite rectangles if debugmode is on
+        if DEBUG_MODE == "ON":
+            for sprite in self.all_sprites:
                 pg.draw.rect(self.screen, BLACK, self.camera.apply_rect(sprite.hit_rect), 1)
         # Draws an outline on the hitbox of all wall rectangles if debugmode is on
         if DEBUG_MODE == "ON":
@@ -335,25 +711,37 @@ class Game:
                 pg.draw.rect(self.screen, BLACK, self.camera.apply_rect(wall.rect), 1)
         if DEBUG_DRAW_GRID == "ON":
             self.draw_grid()
-        for sprite in self.all_sprites:
-            self.screen.blit(sprite.image,self.camera.apply(sprite))
+        with profile('sprites'):
+            self.render_lists.draw(self.screen)
+        with profile('overlays'):
+            self.draw_overlays()
 
         if self.night:
-            self.render_fog()
-
-        # This will draw a rect around the player hitbox (DEBUG_MODE)
-        if DEBUG_MODE == "ON":
-            pg.draw.rect(self.screen, WHITE, self.player.hit_rect, 2)
-        draw_player_health(self.screen, 10,10, self.player.health/PLAYER_HEALTH)
-        self.draw_text('Zombies: {}'.format(len(self.mobs)), self.hud_font, 30, WHITE,
-                       WIDTH - 10, 10, align="ne")
+            with profile('fog'):
+                self.render_fog()
 
-        # If game is paused, draw some text onto the screen
-        if self.paused:
-            self.screen.blit(self.dim_screen, (0,0))
-            self.draw_text("Paused", self.title_font, 105, RED, WIDTH/2, HEIGHT/2, align = "center")
-
-        pg.display.flip()
+    # Draws the HUD on top of everything. Returns the rects it drew in.
+    def draw_hud(self):
+        with self.profiler.section('hud'):
+            # This will draw a rect around the player hitbox (DEBUG_MODE)
+            if DEBUG_MODE == "ON":
+                pg.draw.rect(self.screen, WHITE, self.player.hit_rect, 2)
+            draw_player_health(self.screen, 10,10, self.player.health/PLAYER_HEALTH)
+            text_rect = self.draw_text('Zombies: {}'.format(len(self.mobs)), self.hud_font, 30, WHITE,
+                                       WIDTH - 10, 10, align="ne")
+
+            # If game is paused, draw some text onto the screen
+            if self.paused:
+                self.screen.blit(self.dim_screen, (0,0))
+                self.draw_text("Paused", self.title_font, 105, RED, WIDTH/2, HEIGHT/2, align = "center")
+
+        # The health bar (with its outline) and the zombie counter
+        rects = [pg.Rect(10, 10, 100, 20), text_rect]
+        # Profiler overlay (F3), below the health bar
+        overlay = self.profiler.draw(self.screen)
+        if overlay:
+            rects.append(overlay)
+        return rects
 
     def show_start_screen(self):
         # Game splash/start screen
@@ -386,8 +774,9 @@ class Game:
 
     # Function to draw text onto the screen. (pretty useful)
     def draw_text(self, text, font_name, size, color, x, y, align="nw"):
-        font = pg.font.Font(font_name, size)
-        text_surface = font.render(text, True, color)
+        # Fonts and rendered text are cached, so the HUD doesn't re-open the font
+        # file and re-render the same text every frame
+        text_surface = self.text_cache.render(text, font_name, size, color)
         text_rect = text_surface.get_rect()
         if align == "nw":
             text_rect.topleft = (x, y)
@@ -408,15 +797,28 @@ class Game:
         if align == "center":
             text_rect.center = (x, y)
         self.screen.blit(text_surface, text_rect)
-
-# Starts an instance of the class Game
-g = Game()
-
-# Shows start screen
-g.show_start_screen()
-
-# Runs loop while g.running is true
-while True:
-    g.new()
-    g.run()
-    g.show_go_screen()
+        return text_rect
+
+def game_loop():
+    # Starts an instance of the class Game
+    g = Game()
+
+    # Shows start screen
+    g.show_start_screen()
+
+    # Runs loop while g.running is true
+    level = None
+    while True:
+        g.new(level)
+        g.run()
+        # Killing every zombie goes straight on to the next level (already loaded in
+        # the background). Dying, or clearing the last level, is game over.
+        level = None
+        if len(g.mobs) == 0 and not g.world:
+            level = g.levels.following(g.level_file)
+        if level is None:
+            g.show_go_screen()
+
+# Only start the game when main.py is run, not when it's imported (e.g. by the benchmarks)
+if __name__ == '__main__':
+    game_loop()
@@ -0,0 +1,325 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from collections import namedtuple
+from os import path
+import pygame as pg
+import pytmx
+from pytmx.util_pygame import pygame_image_loader
+from settings import *
+
+# numpy is needed to load compiled maps (and to compile them). Without it the
+# game just keeps parsing the .tmx files.
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+# Compiled maps
+#
+# Loading a .tmx map means pytmx parsing the whole XML file and turning every
+# tile number into python ints in lists of lists, then loading every tile in the
+# tileset, every time a level loads. The compiler below does the parsing once,
+# offline, and writes out just what the game needs, ready to use:
+#
+#   header     - b"ZMAP", format version, map size in tiles, tile size, length
+#                of the index
+#   index      - JSON: the tilesets, where each tile number's image is in its
+#                tileset, where every table is in the file, plus a stamp
+#   layers     - one height x width array of tile numbers per visible tile layer
+#   obstacles  - (x, y, width, height) of every wall, in pixels
+#   spawns     - (type, x, y, width, height) of every player, zombie, health
+#                and shotgun, in the order they're in the map
+#   walkable   - one bit per tile, 1 if no wall covers any of it (same rule as
+#                FlowField.block), rows packed with numpy.packbits
+#
+# Every table is 16 byte aligned, and the game maps the file into memory and
+# uses the tables in place as numpy arrays, so loading a map reads next to
+# nothing until it's drawn.
+#
+# Compile maps with:   python mapcompiler.py maps/level1.tmx [more maps...]
+# which writes maps/level1.zmap next to each one. Old style .txt maps (see Map in
+# tilemap.py: 1 = wall, P = player, M = zombie) can be compiled too. They have no
+# tiles, only walls and spawns. A compiled map that's older than its source (the
+# stamp doesn't match) is ignored, and the source is parsed instead.
+
+MAGIC = b"ZMAP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIHHI")
+ALIGN = 16
+EXTENSION = '.zmap'
+
+# Spawn types, and the object name each one is in the map
+SPAWN_TYPES = ['player', 'zombie', 'health', 'shotgun']
+SPAWN = [('type', '<u4'), ('x', '<f8'), ('y', '<f8'), ('width', '<f8'), ('height', '<f8')]
+OBSTACLE = [('x', '<f8'), ('y', '<f8'), ('width', '<f8'), ('height', '<f8')]
+
+# An object in a compiled map. Has the same attributes Game.new reads from pytmx objects.
+MapObject = namedtuple('MapObject', 'name x y width height')
+
+# The compiled file that goes with a map
+def compiled_name(filename):
+    return path.splitext(filename)[0] + EXTENSION
+
+# Fingerprint of the source map file. If it changes the compiled map is stale.
+def stamp(filename):
+    st = os.stat(filename)
+    return "%d:%d" % (st.st_size, st.st_mtime_ns)
+
+# Everything the compiler writes, before it's packed into the file
+class MapData:
+    def __init__(self,width,height,tilewidth,tileheight):
+        self.width = width
+        self.height = height
+        self.tilewidth = tilewidth
+        self.tileheight = tileheight
+        self.tilesets = []
+        # Tile number -> [tileset, x, y, width, height, flipped h, v, diagonally]
+        # inside the tileset image (tile number 0 is no tile)
+        self.tiles = [None]
+        self.layers = []
+        self.obstacles = []
+        self.spawns = []
+
+    # One bit per tile, 1 if it can be walked on
+    def walkable(self):
+        blocked = np.zeros((self.height, self.width), dtype=bool)
+        for x, y, w, h in self.obstacles:
+            # Same as FlowField.block
+            rect = pg.Rect(x, y, w, h).inflate(-2, -2)
+            top = max(0, rect.top // self.tileheight)
+            bottom = min(self.height, (rect.bottom - 1) // self.tileheight + 1)
+            left = max(0, rect.left // self.tilewidth)
+            right = min(self.width, (rect.right - 1) // self.tilewidth + 1)
+            if top < bottom and left < right:
+                blocked[top:bottom, left:right] = True
+        return np.packbits(~blocked, axis=1)
+
+# Reads a .tmx map (just the XML, no images)
+def read_tmx(filename):
+    tm = pytmx.TiledMap(filename)
+    data = MapData(tm.width, tm.height, tm.tilewidth, tm.tileheight)
+    folder = path.dirname(filename)
+
+    # pytmx numbers the tiles it's seen (gid) in its own order. Work back from
+    # those to the tile in the tileset and how it's flipped.
+    flags = {}
+    for (tiled_gid, tile_flags), value in tm.imagemap.items():
+        if tiled_gid:
+            flags[value[0]] = (tiled_gid, tile_flags)
+    data.tiles = [None] * tm.maxgid
+    for i, ts in enumerate(tm.tilesets):
+        if ts.source is None:
+            raise ValueError("%s: tilesets made of separate images aren't supported" % filename)
+        data.tilesets.append({'image': path.abspath(path.join(folder, ts.source)),
+                              'trans': ts.trans})
+        # Tile positions in the tileset image, in the same order as pytmx
+        rows = range(ts.margin, ts.height + ts.margin - ts.tileheight + 1, ts.tileheight + ts.spacing)
+        cols = range(ts.margin, ts.width + ts.margin - ts.tilewidth + 1, ts.tilewidth + ts.spacing)
+        for gid, (tiled_gid, tile_flags) in flags.items():
+            index = tiled_gid - ts.firstgid
+            if 0 <= index < len(rows) * len(cols):
+                y = rows[index // len(cols)]
+                x = cols[index % len(cols)]
+                data.tiles[gid] = [i, x, y, ts.tilewidth, ts.tileheight,
+                                   int(tile_flags.flipped_horizontally),
+                                   int(tile_flags.flipped_vertically),
+                                   int(tile_flags.flipped_diagonally)]
+
+    dtype = '<u2' if tm.maxgid <= 0xFFFF else '<u4'
+    for layer in tm.visible_layers:
+        if isinstance(layer, pytmx.TiledTileLayer):
+            data.layers.append((layer.name, np.array(layer.data, dtype=dtype)))
+
+    for object in tm.objects:
+        if object.name == 'wall':
+            data.obstacles.append((object.x, object.y, object.width, object.height))
+        elif object.name in SPAWN_TYPES:
+            data.spawns.append((SPAWN_TYPES.index(object.name), object.x, object.y,
+                                object.width, object.height))
+    return data
+
+# Reads an old style .txt map, one character per tile
+def read_txt(filename):
+    with open(filename, 'rt') as f:
+        lines = [line.strip() for line in f]
+    lines = [line for line in lines if line]
+    width = max(len(line) for line in lines)
+    data = MapData(width, len(lines), TILESIZE, TILESIZE)
+    for row, tiles in enumerate(lines):
+        col = 0
+        while col < len(tiles):
+            tile = tiles[col]
+            if tile == '1':
+                # A row of walls next to each other is one obstacle
+                end = col
+                while end < len(tiles) and tiles[end] == '1':
+                    end += 1
+                data.obstacles.append((col * TILESIZE, row * TILESIZE, (end - col) * TILESIZE, TILESIZE))
+                col = end
+                continue
+            if tile == 'P':
+                data.spawns.append((SPAWN_TYPES.index('player'), col * TILESIZE, row * TILESIZE,
+                                    TILESIZE, TILESIZE))
+            if tile == 'M':
+                data.spawns.append((SPAWN_TYPES.index('zombie'), col * TILESIZE, row * TILESIZE,
+                                    TILESIZE, TILESIZE))
+            col += 1
+    return data
+
+def pad(f):
+    f.write(b"\0" * (-f.tell() % ALIGN))
+
+# Compiles a .tmx or .txt map. Returns the name of the compiled file.
+def compile_map(filename,output=None):
+    output = output or compiled_name(filename)
+    if filename.endswith('.txt'):
+        data = read_txt(filename)
+    else:
+        data = read_tmx(filename)
+
+    # Lay the tables out one after the other, from the start of the data
+    tables = [layer for name, layer in data.layers]
+    tables.append(np.array(data.obstacles, dtype=OBSTACLE).reshape(-1))
+    tables.append(np.array(data.spawns, dtype=SPAWN).reshape(-1))
+    tables.append(data.walkable())
+    offsets = []
+    offset = 0
+    for table in tables:
+        offsets.append(offset)
+        offset += table.nbytes
+        offset += -offset % ALIGN
+
+    # Tileset images are found relative to the compiled map
+    folder = path.dirname(path.abspath(output))
+    tilesets = [dict(ts, image=path.relpath(ts['image'], folder)) for ts in data.tilesets]
+    index = {
+        'stamp': stamp(filename),
+        'source': path.basename(filename),
+        'tilesets': tilesets,
+        'tiles': data.tiles,
+        'layers': [{'name': name, 'offset': offsets[i], 'dtype': layer.dtype.str}
+                   for i, (name, layer) in enumerate(data.layers)],
+        'obstacles': {'offset': offsets[-3], 'count': len(data.obstacles)},
+        'spawns': {'offset': offsets[-2], 'count': len(data.spawns)},
+        'walkable': {'offset': offsets[-1], 'bytes': tables[-1].shape[1]},
+    }
+    text = json.dumps(index).encode()
+    with open(output, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, data.width, data.height,
+                            data.tilewidth, data.tileheight, len(text)))
+        f.write(text)
+        pad(f)
+        start = f.tell()
+        for table, offset in zip(tables, offsets):
+            f.write(b"\0" * (start + offset - f.tell()))
+            f.write(table.tobytes())
+    return output
+
+# A compiled map, loaded for the game. Works the same as TiledMap as far as the
+# game is concerned: width, height, objects and render_area.
+class CompiledMap:
+    def __init__(self,filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self.tiles_wide, self.tiles_high, self.tilewidth,
+         self.tileheight, length) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d compiled map" % (filename, VERSION))
+        self.index = json.loads(bytes(self.data[HEADER.size:HEADER.size + length]))
+        start = HEADER.size + length
+        start += -start % ALIGN
+        self.width = self.tiles_wide * self.tilewidth
+        self.height = self.tiles_high * self.tileheight
+
+        # Every table is a numpy array straight on top of the mapped file
+        size = self.tiles_wide * self.tiles_high
+        self.layers = [np.frombuffer(self.data, layer['dtype'], size, start + layer['offset'])
+                       .reshape(self.tiles_high, self.tiles_wide) for layer in self.index['layers']]
+        entry = self.index['obstacles']
+        self.obstacles = np.frombuffer(self.data, OBSTACLE, entry['count'], start + entry['offset'])
+        entry = self.index['spawns']
+        self.spawns = np.frombuffer(self.data, SPAWN, entry['count'], start + entry['offset'])
+        entry = self.index['walkable']
+        self.walkable = np.frombuffer(self.data, np.uint8, entry['bytes'] * self.tiles_high,
+                                      start + entry['offset']).reshape(self.tiles_high, entry['bytes'])
+
+        # Walls then spawns, in the same form as TiledMap.objects
+        self.objects = [MapObject('wall', *obstacle) for obstacle in self.obstacles.tolist()]
+        self.objects.extend(MapObject(SPAWN_TYPES[spawn[0]], *spawn[1:]) for spawn in self.spawns.tolist())
+        # Tile images, loaded the first time they're drawn
+        self.images = [None] * len(self.index['tiles'])
+        self.loaders = None
+
+    # True if the compiled map was made from its source map as it is now
+    def fresh(self,source):
+        try:
+            return self.index['stamp'] == stamp(source)
+        except OSError:
+            return False
+
+    # The image for a tile number. Tiles are cut out of the tileset image (and
+    # flipped) exactly the way pytmx does it.
+    def tile_image(self,gid):
+        image = self.images[gid]
+        if image is None:
+            if self.loaders is None:
+                folder = path.dirname(self.filename)
+                self.loaders = [pygame_image_loader(path.join(folder, ts['image']), ts['trans'], pixelalpha=True)
+                                for ts in self.index['tilesets']]
+            tileset, x, y, w, h, fh, fv, fd = self.index['tiles'][gid]
+            image = self.images[gid] = self.loaders[tileset]((x, y, w, h), pytmx.TileFlags(fh, fv, fd))
+        return image
+
+    # Which tiles are blocked by walls, one byte per tile (1 = blocked), the same
+    # as FlowField.blocked
+    def blocked(self):
+        walkable = np.unpackbits(self.walkable, axis=1, count=self.tiles_wide)
+        return bytearray((1 - walkable).tobytes())
+
+    # Renders just the tiles inside area (a rect in map pixels) onto surface, with
+    # the top left of area at the top left of surface. Used by ChunkedMap.
+    def render_area(self,surface,area):
+        tw = self.tilewidth
+        th = self.tileheight
+        left = max(0, area.left // tw)
+        top = max(0, area.top // th)
+        right = min(self.tiles_wide, (area.right + tw - 1) // tw)
+        bottom = min(self.tiles_high, (area.bottom + th - 1) // th)
+        if left >= right or top >= bottom:
+            return
+        for layer in self.layers:
+            block = layer[top:bottom, left:right]
+            ys, xs = np.nonzero(block)
+            gids = block[ys, xs].tolist()
+            xs = ((xs + left) * tw - area.x).tolist()
+            ys = ((ys + top) * th - area.y).tolist()
+            surface.blits([(self.tile_image(gid), (x, y)) for gid, x, y in zip(gids, xs, ys)
+                           if self.index['tiles'][gid]], False)
+
+# Loads the compiled version of a map if there's an up to date one, otherwise
+# returns None
+def open_compiled(source):
+    filename = compiled_name(source)
+    if not HAVE_NUMPY or not path.exists(filename):
+        return None
+    try:
+        compiled = CompiledMap(filename)
+    except (OSError, ValueError):
+        return None
+    return compiled if compiled.fresh(source) else None
+
+# Compiles maps: python mapcompiler.py maps/level1.tmx [more maps...]
+if __name__ == '__main__':
+    if not HAVE_NUMPY:
+        sys.exit("numpy is needed to compile maps")
+    if len(sys.argv) < 2:
+        sys.exit("usage: python mapcompiler.py map.tmx [map.tmx ...]")
+    for filename in sys.argv[1:]:
+        output = compile_map(filename)
+        print("Compiled %s to %s (%.1f KB)" % (filename, output, path.getsize(output) / 1024))
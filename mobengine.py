@@ -0,0 +1,248 @@
+from settings import *
+
+# numpy is only needed for the batched mob engine. If it isn't installed the
+# game just uses the normal one-sprite-at-a-time Mob class instead.
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+# Batched mob engine
+#
+# Instead of every Mob doing its own Vector2 maths in Mob.update, the engine keeps
+# the state of the whole horde in numpy arrays (one array per attribute, one row
+# per mob, "structure of arrays") and moves every mob at once with a handful of
+# array operations per frame:
+#   1. seek      - unit vector along the flow field (or straight at the player)
+#   2. separate  - push away from every other mob closer than AVOID_RADIUS
+#   3. integrate - the same equations of motion as Mob.update
+#   4. walls     - the same x then y push-out as collide_with_walls
+#
+# BatchedMob sprites (sprites.py) don't store anything themselves, they just read
+# and write their own row (slot) of these arrays.
+class MobEngine:
+    def __init__(self,game,capacity=256):
+        self.game = game
+        self.capacity = capacity
+        # Number of slots handed out so far, and slots of dead mobs that can be reused
+        self.count = 0
+        self.free = []
+
+        self.pos = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.acc = np.zeros((capacity, 2))
+        self.speed = np.zeros(capacity)
+        self.health = np.zeros(capacity)
+        self.rot = np.zeros(capacity)
+        self.alive = np.zeros(capacity, dtype=bool)
+        # True if the mob could see the player (within DETECT_RADIUS) this frame
+        self.active = np.zeros(capacity, dtype=bool)
+
+        # Size of a mob hit rect, used for wall collisions
+        self.hit_size = (MOB_HIT_RECT.width, MOB_HIT_RECT.height)
+        # Wall rects as an (n, 4) array of x, y, w, h. Walls never move after
+        # Game.new, so this is built once on the first update (and again whenever
+        # the endless world adds or removes walls, see world.py)
+        self.walls = None
+        # The flow field as arrays: direction per tile, and the field (and its version)
+        # they came from. The endless world makes a whole new field when walls change,
+        # and its version starts at 0 again, so the version alone isn't enough.
+        self.flow_dirs = None
+        self.flow_field = None
+        self.flow_version = None
+
+    # Doubles the size of every array when we run out of slots
+    def grow(self):
+        new_capacity = self.capacity * 2
+        for name in ('pos', 'vel', 'acc', 'speed', 'health', 'rot', 'alive', 'active'):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.capacity] = old
+            setattr(self, name, new)
+        self.capacity = new_capacity
+
+    # Gives a new mob a slot in the arrays and returns the slot number
+    def add(self,x,y,speed,health):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.count == self.capacity:
+                self.grow()
+            slot = self.count
+            self.count += 1
+        self.pos[slot] = (x, y)
+        self.vel[slot] = 0
+        self.acc[slot] = 0
+        self.speed[slot] = speed
+        self.health[slot] = health
+        self.rot[slot] = 0
+        self.alive[slot] = True
+        self.active[slot] = False
+        return slot
+
+    def remove(self,slot):
+        if self.alive[slot]:
+            self.alive[slot] = False
+            self.active[slot] = False
+            self.free.append(slot)
+
+    def load_walls(self):
+        rects = [wall.rect for wall in self.game.walls]
+        if rects:
+            self.walls = np.array([(r.x, r.y, r.width, r.height) for r in rects], dtype=float)
+        else:
+            self.walls = np.zeros((0, 4))
+
+    def update(self,dt):
+        if self.walls is None:
+            self.load_walls()
+
+        # Indices of every live mob
+        idx = np.flatnonzero(self.alive[:self.count])
+        self.active[:self.count] = False
+        if len(idx) == 0:
+            return
+        pos = self.pos[idx]
+
+        # Only mobs within DETECT_RADIUS of the player move (same as Mob.update)
+        target = self.game.player.pos
+        to_target = np.array((target.x, target.y)) - pos
+        dist_sq = (to_target ** 2).sum(axis=1)
+        active = dist_sq < DETECT_RADIUS ** 2
+        if not active.any():
+            return
+        moving = idx[active]
+        self.active[moving] = True
+
+        # 1. Seek: follow the flow field, or go straight at the player where it
+        # doesn't have a direction, and face the way we're going
+        to_target = to_target[active]
+        length = np.sqrt(dist_sq[active])[:, None]
+        acc = np.divide(to_target, length, out=np.zeros_like(to_target), where=length > 0)
+        flow = self.flow_directions(pos[active])
+        has_flow = (flow != 0).any(axis=1)
+        acc[has_flow] = flow[has_flow]
+        self.rot[moving] = -np.degrees(np.arctan2(acc[:, 1], acc[:, 0]))
+
+        # 2. Separation against every live mob, not just the moving ones
+        acc += self.separation(pos, np.flatnonzero(active))
+
+        # 3. Integrate. acc is scaled to the mobs speed, then friction (-vel) is added
+        length = np.sqrt((acc ** 2).sum(axis=1))[:, None]
+        acc = np.divide(acc, length, out=np.zeros_like(acc), where=length > 0)
+        acc *= self.speed[moving][:, None]
+        vel = self.vel[moving]
+        acc -= vel
+        vel += acc * dt
+        old_pos = pos[active]
+        new_pos = old_pos + vel * dt + 0.5 * acc * dt ** 2
+        self.acc[moving] = acc
+
+        # 4. Walls, like collide_with_walls. The x axis is checked first, while the
+        # mob is still at its old y, then the y axis
+        check = np.column_stack((new_pos[:, 0], old_pos[:, 1]))
+        self.collide_walls(check, vel, 0)
+        new_pos[:, 0] = check[:, 0]
+        self.collide_walls(new_pos, vel, 1)
+
+        self.pos[moving] = new_pos
+        self.vel[moving] = vel
+
+    # Flow field direction at each position, (0, 0) where the field has none
+    def flow_directions(self,pos):
+        field = self.game.flow_field
+        if field is not self.flow_field or field.version != self.flow_version:
+            self.flow_dirs = np.column_stack((field.dir_x, field.dir_y))
+            self.flow_field = field
+            self.flow_version = field.version
+        x = np.floor(pos[:, 0] / field.tilesize).astype(np.int64) - field.left
+        y = np.floor(pos[:, 1] / field.tilesize).astype(np.int64) - field.top
+        inside = (x >= 0) & (x < field.cols) & (y >= 0) & (y < field.rows)
+        dirs = np.zeros_like(pos)
+        dirs[inside] = self.flow_dirs[y[inside] * field.cols + x[inside]]
+        return dirs
+
+    # Separation steering for the mobs at rows `query` of pos, against every row of pos.
+    #
+    # Rather than comparing every mob with every other mob, mobs are sorted by which
+    # AVOID_RADIUS sized grid cell they're in (the same idea as the SpatialHash in
+    # spatial.py). Each query mob then only gets paired with the mobs in the 3x3
+    # cells around it. All the pairs are built at once with numpy, so there are no
+    # python loops over mobs at all.
+    def separation(self,pos,query):
+        push = np.zeros((len(query), 2))
+        if len(pos) < 2:
+            return push
+
+        size = AVOID_RADIUS
+        cell = np.floor(pos / size).astype(np.int64)
+        # Shift cells so they start at 1, which leaves room for the -1 neighbour
+        cell -= cell.min(axis=0) - 1
+        rows = cell[:, 1].max() + 2
+        keys = cell[:, 0] * rows + cell[:, 1]
+
+        # Sort mobs by cell, and find where each cells mobs start in the sorted order
+        order = np.argsort(keys, kind='stable')
+        cell_keys, cell_start, cell_count = np.unique(keys[order], return_index=True,
+                                                      return_counts=True)
+
+        # Key of each of the 9 neighbouring cells, for every query mob
+        offsets = np.array([dx * rows + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+        wanted = (keys[query][:, None] + offsets[None, :]).ravel()
+        owner = np.repeat(np.arange(len(query)), len(offsets))
+
+        # Look the neighbour cells up, throwing away empty ones
+        found = np.searchsorted(cell_keys, wanted)
+        found = np.minimum(found, len(cell_keys) - 1)
+        hit = cell_keys[found] == wanted
+        owner = owner[hit]
+        found = found[hit]
+
+        # Expand every (query mob, cell) into one (query mob, other mob) pair per mob in the cell
+        counts = cell_count[found]
+        total = counts.sum()
+        if total == 0:
+            return push
+        pair_owner = np.repeat(owner, counts)
+        first = np.repeat(cell_start[found], counts)
+        step = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        other = order[first + step]
+
+        # Push away from every mob closer than AVOID_RADIUS, one unit vector per mob
+        dist = pos[query[pair_owner]] - pos[other]
+        dist_sq = (dist ** 2).sum(axis=1)
+        close = (dist_sq > 0) & (dist_sq < AVOID_RADIUS ** 2) & (query[pair_owner] != other)
+        dist = dist[close] / np.sqrt(dist_sq[close])[:, None]
+        pair_owner = pair_owner[close]
+        push[:, 0] = np.bincount(pair_owner, weights=dist[:, 0], minlength=len(query))
+        push[:, 1] = np.bincount(pair_owner, weights=dist[:, 1], minlength=len(query))
+        return push
+
+    # Pushes mobs out of walls along one axis (0 = x, 1 = y). Works the same as
+    # collide_with_walls: the first wall hit decides which side the mob goes to.
+    def collide_walls(self,pos,vel,axis):
+        width, height = self.hit_size
+        # pygame rects with no width or height never collide with anything
+        if len(self.walls) == 0 or width == 0 or height == 0:
+            return
+        walls = self.walls
+        left = pos[:, 0:1] - width / 2
+        top = pos[:, 1:2] - height / 2
+        overlap = ((left < walls[:, 0] + walls[:, 2]) & (left + width > walls[:, 0]) &
+                   (top < walls[:, 1] + walls[:, 3]) & (top + height > walls[:, 1]))
+        hit = overlap.any(axis=1)
+        if not hit.any():
+            return
+        first = walls[overlap[hit].argmax(axis=1)]
+
+        half = (width, height)[axis] / 2
+        wall_start = first[:, axis]
+        wall_end = first[:, axis] + first[:, axis + 2]
+        wall_centre = wall_start + first[:, axis + 2] / 2
+        current = pos[hit, axis]
+        moved = np.where(wall_centre > current, wall_start - half, current)
+        moved = np.where(wall_centre < current, wall_end + half, moved)
+        pos[hit, axis] = moved
+        vel[hit, axis] = 0
@@ -0,0 +1,169 @@
+import csv
+import json
+import time
+from collections import deque
+import pygame as pg
+from settings import *
+
+# Frame profiler
+#
+# Times each part of a frame (events, every sprite class's update, the collision
+# checks, map, sprites, fog, HUD, flip...) so we can see which one blows the frame
+# budget on a given map. Code being timed is wrapped like this:
+#
+#   with self.profiler.section('fog'):
+#       self.render_fog()
+#
+# A section can run more than once a frame (e.g. several game steps in one frame),
+# the times just add up. For every section the profiler keeps the last
+# PROFILE_WINDOW frames, to work out rolling percentiles for the overlay (F3), and
+# every frame ever recorded (up to PROFILE_MAX_FRAMES) for dump.
+#
+# While it's off, section() gives back a shared do-nothing section, so leaving the
+# with blocks in the code costs next to nothing.
+class Profiler:
+    def __init__(self,enabled=False,window=PROFILE_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.overlay = False
+        # Section name -> Section, so each one is only made once
+        self.sections = {}
+        # Times (ms) for the frame in progress
+        self.current = {}
+        # Section name -> the last window frame times (ms), 0 if it didn't run
+        self.history = {}
+        # Every recorded frame, as a dictionary of section name -> ms
+        self.frames = deque(maxlen=PROFILE_MAX_FRAMES)
+        self.frame_start = None
+        self.frame_count = 0
+        # The overlay is only re-rendered every PROFILE_OVERLAY_REFRESH frames
+        self.overlay_image = None
+        self.font = None
+
+    def section(self,name):
+        if not self.enabled:
+            return NULL_SECTION
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = Section(self, name)
+        return section
+
+    # Adds seconds to a section for the frame in progress
+    def add(self,name,seconds):
+        self.current[name] = self.current.get(name, 0.0) + seconds * 1000
+
+    def begin_frame(self):
+        if self.enabled:
+            self.current = {}
+            self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if not self.enabled or self.frame_start is None:
+            return
+        self.current['frame'] = (time.perf_counter() - self.frame_start) * 1000
+        self.frame_start = None
+        self.frame_count += 1
+        # Sections seen for the first time start with a window of zeros
+        for name in self.current:
+            if name not in self.history:
+                self.history[name] = deque([0.0] * min(self.frame_count - 1, self.window),
+                                           maxlen=self.window)
+        for name, times in self.history.items():
+            times.append(self.current.get(name, 0.0))
+        self.frames.append(self.current)
+
+    # Shows/hides the overlay. Turning it on also starts recording.
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.enabled = self.enabled or self.overlay
+        self.overlay_image = None
+
+    # (p50, p95, p99) in ms for a section over the last window frames
+    def percentiles(self,name):
+        times = sorted(self.history.get(name, ()))
+        if not times:
+            return (0.0, 0.0, 0.0)
+        last = len(times) - 1
+        return tuple(times[int(round(last * p))] for p in (0.5, 0.95, 0.99))
+
+    # Section names, biggest p95 first, with the whole frame at the top
+    def names(self):
+        names = sorted(self.history, key=lambda name: -self.percentiles(name)[1])
+        if 'frame' in names:
+            names.remove('frame')
+            names.insert(0, 'frame')
+        return names
+
+    # Draws the percentile table in the top left corner. Returns the rect it covers.
+    def draw(self,surface):
+        if not self.overlay:
+            return None
+        if self.overlay_image is None or self.frame_count % PROFILE_OVERLAY_REFRESH == 0:
+            self.overlay_image = self.render()
+        return surface.blit(self.overlay_image, (10, 40))
+
+    def render(self):
+        if self.font is None:
+            self.font = pg.font.SysFont('monospace', 14)
+        budget = 1000 / FPS
+        lines = [("{:<22}{:>8}{:>8}{:>8}".format("ms", "p50", "p95", "p99"), WHITE)]
+        for name in self.names():
+            p50, p95, p99 = self.percentiles(name)
+            # Anything that takes a whole frame budget by itself on a bad frame is red
+            col = RED if p95 > budget else YELLOW if p99 > budget else WHITE
+            lines.append(("{:<22}{:>8.2f}{:>8.2f}{:>8.2f}".format(name[:21], p50, p95, p99), col))
+        height = self.font.get_linesize()
+        width = max(self.font.size(text)[0] for text, col in lines)
+        image = pg.Surface((width + 10, height * len(lines) + 10), pg.SRCALPHA)
+        image.fill((0, 0, 0, 180))
+        for i, (text, col) in enumerate(lines):
+            image.blit(self.font.render(text, True, col), (5, 5 + i * height))
+        return image
+
+    # Writes every recorded frame to a file. Anything but a .json file is CSV: a
+    # frame_number column and one column per section, one row per frame, in ms.
+    # A .json file gets one object:
+    #   {"percentiles": {section: {"p50": ms, "p95": ms, "p99": ms}, ...},
+    #    "frames": [{section: ms, ...}, ...]}
+    # with the percentiles over the last window frames, and every recorded frame
+    # (sections that didn't run in a frame are left out of it).
+    def dump(self,filename):
+        frames = list(self.frames)
+        if filename.endswith('.json'):
+            percentiles = {}
+            for name in self.names():
+                percentiles[name] = dict(zip(('p50', 'p95', 'p99'), self.percentiles(name)))
+            with open(filename, 'w') as f:
+                json.dump({'percentiles': percentiles, 'frames': frames}, f)
+            return
+        names = self.names()
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame_number'] + names)
+            for i, frame in enumerate(frames):
+                writer.writerow([i] + ["{:.4f}".format(frame.get(name, 0.0)) for name in names])
+
+# A timed block of code, used with with (see Profiler)
+class Section:
+    def __init__(self,profiler,name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+# Section used while the profiler is off
+class NullSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+NULL_SECTION = NullSection()
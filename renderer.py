@@ -0,0 +1,201 @@
+import pygame as pg
+from settings import *
+
+# Dirty rect renderer (optional, DIRTY_RECTS = "ON" in settings.py)
+#
+# The normal Game.draw redraws the whole map, every sprite and the fog and then
+# flips the whole screen every frame. When the camera hasn't moved, most of the
+# screen is exactly the same as last frame, so this renderer works out which parts
+# of the screen actually changed (dirty rects) and only redraws and pushes those
+# with pg.display.update(rects).
+#
+# A part of the screen is dirty if a sprite moved, changed image, appeared or
+# disappeared there, if the players light moved there, or if it's under the HUD.
+# Whenever the camera scrolls everything moves, so it falls back to a full redraw.
+class DirtyRenderer:
+    def __init__(self,game):
+        self.game = game
+        self.screen_rect = game.screen.get_rect()
+        # Camera offset and light rects from the last frame drawn
+        self.last_offset = None
+        self.last_lights = []
+        # sprite -> (screen rect, image) from the last frame drawn
+        self.last_sprites = {}
+        # Rects the HUD and the health bars were drawn in last frame
+        self.last_hud = []
+        self.last_bars = []
+        # Stats from the last frame
+        self.full_redraws = 0
+        self.partial_redraws = 0
+        self.dirty_area = 0
+
+    # Draws everything and flips the whole screen
+    def draw_full(self):
+        game = self.game
+        game.draw_world()
+        self.last_hud = game.draw_hud()
+        with game.profiler.section('flip'):
+            pg.display.flip()
+        self.full_redraws += 1
+        self.dirty_area = self.screen_rect.width * self.screen_rect.height
+
+    def draw(self):
+        game = self.game
+        profile = game.profiler.section
+
+        # Where every sprite that can be seen is on screen this frame, in drawing
+        # (layer) order. Sprites that go off screen count as gone.
+        sprites = game.render_lists.sprites
+        rects = game.render_lists.rects
+        current = {}
+        for sprite, rect in zip(sprites, rects):
+            # (The player fades its image in and out with surface alpha when it's hurt)
+            current[sprite] = (rect, sprite.image, sprite.image.get_alpha())
+        bars = game.render_lists.bars
+        bar_rects = [rect for col, rect in bars]
+
+        offset = game.camera.camera.topleft
+        lights = game.lights() if game.night else []
+        light_rects = [rect for patch, rect in lights]
+        previous = self.last_sprites
+        self.last_sprites = current
+
+        # Camera scrolled (everything moved), paused (dimmed screen) or debug drawing:
+        # just redraw the lot
+        if offset != self.last_offset or game.paused or DEBUG_MODE == "ON" or DEBUG_DRAW_GRID == "ON":
+            self.last_offset = offset
+            self.last_lights = light_rects
+            self.last_bars = bar_rects
+            self.draw_full()
+            return
+
+        # Work out what changed since last frame
+        dirty = list(self.last_hud)
+        for sprite, (rect, image, alpha) in current.items():
+            old = previous.pop(sprite, None)
+            if old is None:
+                dirty.append(rect)
+            elif old[0] != rect or old[1] is not image or old[2] != alpha:
+                dirty.append(old[0])
+                dirty.append(rect)
+        # Whatever is left in previous has gone (killed) since last frame
+        for rect, image, alpha in previous.values():
+            dirty.append(rect)
+        # Health bars are tiny, just redraw where they were and where they are
+        dirty.extend(self.last_bars)
+        dirty.extend(bar_rects)
+        self.last_bars = bar_rects
+        # Lights that moved, appeared or went out change the fog under them
+        if light_rects != self.last_lights:
+            dirty.extend(self.last_lights)
+            dirty.extend(light_rects)
+            self.last_lights = light_rects
+
+        dirty = merge_rects([r.clip(self.screen_rect) for r in dirty if r.colliderect(self.screen_rect)])
+        area = sum(r.width * r.height for r in dirty)
+        # If most of the screen changed anyway, a full redraw is quicker
+        if len(dirty) > DIRTY_MAX_RECTS or area > DIRTY_MAX_AREA * self.screen_rect.width * self.screen_rect.height:
+            self.draw_full()
+            return
+
+        # Redraw just the dirty parts: map, then the sprites touching each part, then fog
+        screen = game.screen
+        for rect in dirty:
+            screen.set_clip(rect)
+            with profile('map'):
+                game.map_chunks.draw(screen, game.camera, rect)
+            with profile('sprites'):
+                for i in rect.collidelistall(rects):
+                    screen.blit(sprites[i].image, rects[i])
+            with profile('overlays'):
+                for i in rect.collidelistall(bar_rects):
+                    screen.fill(bars[i][0], bar_rects[i])
+        screen.set_clip(None)
+        if game.night:
+            with profile('fog'):
+                game.render_fog(dirty, lights)
+
+        hud = game.draw_hud()
+        with profile('flip'):
+            pg.display.update(dirty + hud)
+        self.last_hud = hud
+        self.partial_redraws += 1
+        self.dirty_area = area
+
+# Joins overlapping rects together until none of them overlap, so no part of the
+# screen gets redrawn twice
+def merge_rects(rects):
+    merged = []
+    for rect in rects:
+        rect = rect.copy()
+        joined = True
+        while joined:
+            joined = False
+            for i in range(len(merged)):
+                if rect.colliderect(merged[i]):
+                    rect.union_ip(merged.pop(i))
+                    joined = True
+                    break
+        merged.append(rect)
+    return merged
+
+# Sprite render lists
+#
+# Drawing used to go through every sprite in all_sprites every frame, working out
+# a screen rect for it and blitting it, even when it was nowhere near the screen.
+# Now, once a frame, collect goes through all_sprites one layer at a time (every
+# layer is one kind of sprite: walls and items, player and mobs, bullets,
+# effects) and throws away everything outside the cameras viewport with a single
+# collidelistall per layer, before doing anything else per sprite. Only the sprites
+# left get a screen rect, and they're all drawn with one Surface.blits call.
+class RenderLists:
+    def __init__(self,game):
+        self.game = game
+        # Sprites that can be seen this frame, in drawing (layer) order, and where
+        # on the screen they go
+        self.sprites = []
+        self.rects = []
+        # Mobs that can be seen this frame, and their health bars
+        self.mobs = []
+        self.bars = []
+        # How many sprites were drawn and culled this frame
+        self.drawn = 0
+        self.culled = 0
+
+    def collect(self):
+        game = self.game
+        # Sprites can be drawn part of a step away from their rect (interpolation),
+        # so look a bit past the edges of the screen
+        view = game.camera.viewport().inflate(CULL_MARGIN * 2, CULL_MARGIN * 2)
+        all_sprites = game.all_sprites
+        visible = []
+        total = 0
+        for layer in all_sprites.layers():
+            sprites = all_sprites.get_sprites_from_layer(layer)
+            total += len(sprites)
+            for i in view.collidelistall([sprite.rect for sprite in sprites]):
+                visible.append(sprites[i])
+
+        if game.alpha < 1:
+            rects = [game.sprite_rect(sprite) for sprite in visible]
+        else:
+            offset = game.camera.camera.topleft
+            rects = [sprite.rect.move(offset) for sprite in visible]
+
+        mobs = game.mobs.sprites()
+        self.mobs = [mobs[i] for i in view.collidelistall([mob.rect for mob in mobs])]
+        # Health bars of the mobs on screen, as (colour, screen rect)
+        self.bars = []
+        for mob in self.mobs:
+            bar = mob.health_bar()
+            if bar:
+                rect = game.sprite_rect(mob)
+                self.bars.append((bar[0], pg.Rect(rect.x, rect.y, bar[1], 7)))
+        self.sprites = visible
+        self.rects = rects
+        self.drawn = len(visible)
+        self.culled = total - len(visible)
+
+    # Blits every visible sprite onto surface in one go
+    def draw(self,surface):
+        surface.blits([(sprite.image, rect) for sprite, rect in zip(self.sprites, self.rects)], False)
@@ -0,0 +1,203 @@
+import hashlib
+import struct
+import sys
+import pygame as pg
+from settings import *
+
+# Input recording and replay
+#
+# Everything that happens in a game comes from three things: the random seed
+# (Game.new seeds python's random with it), the map, and what the player pressed
+# on each game step (tick). The game runs in fixed steps (see Game.run) and never
+# reads the real clock, so feeding the same seed, map and per-tick input back in
+# plays out exactly the same game, bit for bit, as fast as the computer can go.
+#
+# So a session that had a performance spike can be recorded (RECORD_INPUT = "ON")
+# and then replayed headless with the profiler on:
+#
+#   python replay.py session.rec --profile spike.csv
+#
+# File format (little endian):
+#   header      - b"ZREC", version, seed, SIM_RATE, tick count, length of the map
+#                 name, number of input runs, number of checkpoints
+#   map name    - utf-8 ('' for the default level)
+#   config      - settings that change how the game plays (see config), utf-8
+#   input runs  - (input byte, number of ticks) pairs. Input barely changes from
+#                 one tick to the next, so this is usually tiny
+#   checkpoints - (tick, hash of the game state) every REPLAY_CHECKPOINT ticks, and
+#                 one after the last tick, to find where a replay goes different
+
+MAGIC = b"ZREC"
+VERSION = 1
+HEADER = struct.Struct("<4sHQHIHII")
+RUN = struct.Struct("<BH")
+CHECKPOINT = struct.Struct("<IQ")
+
+# Bits of the input byte
+LEFT, RIGHT, UP, DOWN, SHOOT = 1, 2, 4, 8, 16
+
+# What the player is pressing on one tick. Player.get_keys reads this instead of
+# the keyboard, so it can come from the keyboard or from a recording.
+class InputState:
+    def __init__(self,bits=0):
+        self.bits = bits
+        self.left = bool(bits & LEFT)
+        self.right = bool(bits & RIGHT)
+        self.up = bool(bits & UP)
+        self.down = bool(bits & DOWN)
+        self.shoot = bool(bits & SHOOT)
+
+# All 32 possible input states, made once
+INPUT_STATES = [InputState(bits) for bits in range(32)]
+
+# Reads the real keyboard and mouse
+class LiveInput:
+    def poll(self):
+        keys = pg.key.get_pressed()
+        click = pg.mouse.get_pressed()
+        bits = 0
+        if keys[pg.K_LEFT] or keys[pg.K_a]:
+            bits |= LEFT
+        if keys[pg.K_RIGHT] or keys[pg.K_d]:
+            bits |= RIGHT
+        if keys[pg.K_UP] or keys[pg.K_w]:
+            bits |= UP
+        if keys[pg.K_DOWN] or keys[pg.K_s]:
+            bits |= DOWN
+        if keys[pg.K_SPACE] or click[0] == 1:
+            bits |= SHOOT
+        return INPUT_STATES[bits]
+
+    def after_tick(self,game):
+        pass
+
+# Settings that change how the game plays out. A replay only matches if these
+# are the same as when it was recorded.
+def config():
+    return "BATCHED_MOBS={} BULLET_POOL={} SIM_RATE={} DEBUG_MODE={} WORLD_MODE={} LOD={}".format(
+        BATCHED_MOBS, BULLET_POOL, SIM_RATE, DEBUG_MODE, WORLD_MODE, LOD)
+
+# 64 bit hash of everything that moves in the game
+def state_hash(game):
+    data = [struct.pack("<d4f", game.sim_time, game.player.pos.x, game.player.pos.y,
+                        game.player.rot, game.player.health)]
+    for mob in game.mobs:
+        data.append(struct.pack("<3f", mob.pos.x, mob.pos.y, mob.health))
+    for bullet in game.bullets:
+        data.append(struct.pack("<2i", bullet.rect.centerx, bullet.rect.centery))
+    return struct.unpack("<Q", hashlib.sha1(b"".join(data)).digest()[:8])[0]
+
+# Records the input of a game. Game.step calls tick with every ticks input, and
+# the recording is written out with save when the game ends.
+class Recorder:
+    def __init__(self,seed,map_name=''):
+        self.seed = seed
+        self.map_name = map_name
+        # [input bits, number of ticks] runs
+        self.runs = []
+        self.ticks = 0
+        self.checkpoints = []
+
+    # Called after each tick has run, with the input it used
+    def tick(self,game,state):
+        if self.runs and self.runs[-1][0] == state.bits and self.runs[-1][1] < 0xFFFF:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([state.bits, 1])
+        self.ticks += 1
+        if self.ticks % REPLAY_CHECKPOINT == 0:
+            self.checkpoints.append((self.ticks, state_hash(game)))
+
+    def save(self,filename,game):
+        checkpoints = list(self.checkpoints)
+        if not checkpoints or checkpoints[-1][0] != self.ticks:
+            checkpoints.append((self.ticks, state_hash(game)))
+        name = self.map_name.encode()
+        settings = config().encode()
+        with open(filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.seed, SIM_RATE, self.ticks, len(name),
+                                len(self.runs), len(checkpoints)))
+            f.write(name)
+            f.write(struct.pack("<H", len(settings)) + settings)
+            for bits, count in self.runs:
+                f.write(RUN.pack(bits, count))
+            for tick, value in checkpoints:
+                f.write(CHECKPOINT.pack(tick, value))
+
+# A recording being played back. Used as the games input source, it hands out
+# the recorded input one tick at a time, and checks the state hashes as it goes.
+class Replay:
+    def __init__(self,filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        (magic, version, self.seed, self.sim_rate, self.ticks, name_length,
+         runs, checkpoints) = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d recording" % (filename, VERSION))
+        at = HEADER.size
+        self.map_name = data[at:at + name_length].decode()
+        at += name_length
+        length, = struct.unpack_from("<H", data, at)
+        self.config = data[at + 2:at + 2 + length].decode()
+        at += 2 + length
+        self.inputs = bytearray()
+        for i in range(runs):
+            bits, count = RUN.unpack_from(data, at)
+            self.inputs.extend(bytes((bits,)) * count)
+            at += RUN.size
+        self.checkpoints = {}
+        for i in range(checkpoints):
+            tick, value = CHECKPOINT.unpack_from(data, at)
+            self.checkpoints[tick] = value
+            at += CHECKPOINT.size
+        self.tick = 0
+        # First tick where the game state didn't match the recording, or None
+        self.diverged = None
+        self.checked = 0
+
+    def poll(self):
+        return INPUT_STATES[self.inputs[self.tick]]
+
+    # Called after each tick has run
+    def after_tick(self,game):
+        self.tick += 1
+        if self.tick in self.checkpoints:
+            self.checked += 1
+            if self.diverged is None and state_hash(game) != self.checkpoints[self.tick]:
+                self.diverged = self.tick
+        if self.tick >= self.ticks:
+            game.playing = False
+
+# Plays a recording back headless, as fast as possible. Returns the game and the
+# replay (replay.diverged is None if it played out exactly like the recording)
+def play(filename,draw=True,profile=None):
+    import main
+    replay = Replay(filename)
+    if replay.config != config():
+        print("Warning: recorded with", replay.config)
+    game = main.Game(headless=True)
+    if profile:
+        game.profiler.enabled = True
+    game.new(replay.map_name or None, seed=replay.seed)
+    game.input_source = replay
+    frames, seconds = game.run_headless(replay.ticks, draw=draw, dt=1 / replay.sim_rate)
+    print("Replayed {} ticks in {:.2f}s ({:.0f} ticks/s), {} checkpoints checked".format(
+        frames, seconds, frames / seconds if seconds else 0, replay.checked))
+    if replay.diverged is None:
+        print("Replay matches the recording")
+    else:
+        print("Replay went different from the recording by tick", replay.diverged)
+    if profile:
+        game.profiler.dump(profile)
+    return game, replay
+
+# python replay.py session.rec [--no-draw] [--profile frames.csv]
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay a recorded session headless")
+    parser.add_argument('recording')
+    parser.add_argument('--no-draw', action='store_true', help="only run the game, don't draw it")
+    parser.add_argument('--profile', help="write per-frame profiler timings to this .csv/.json file")
+    args = parser.parse_args()
+    game, replay = play(args.recording, not args.no_draw, args.profile)
+    sys.exit(0 if replay.diverged is None else 1)
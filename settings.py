@@ -28,8 +28,16 @@ BROWN = (106,55,5)
 WIDTH = 1024 # 16 * 64 or 32 * 32 or 64 * 16
 HEIGHT = 768 # 16 * 48 or 32 * 24 or 64 * 12
 FPS = 60
+# The game world is updated SIM_RATE times a second, no matter how fast frames are
+# drawn (FPS). After a slow frame, at most MAX_CATCHUP_STEPS updates are run to
+# catch up, and any more time than that is skipped.
+SIM_RATE = 60
+MAX_CATCHUP_STEPS = 5
 TITLE = "Tilemap"
 BGCOLOR = BROWN
+# Prebuilt images and sounds (make it with: python assetpack.py). If it's missing
+# or out of date the game loads everything from img/ and snd/ instead.
+ASSET_PACK = "assets.pack"
 
 # Tilesize can be modified, however it needs to be a multiple of 32.
 TILESIZE = 64
@@ -38,6 +46,48 @@ GRIDHEIGHT = HEIGHT/TILESIZE
 
 WALL_IMG = 'tileGreen_39.png'
 
+# The map is drawn in MAP_CHUNK_SIZE pixel square chunks, rendered when they come
+# within MAP_CHUNK_MARGIN pixels of the screen. Rendered chunks are kept until they
+# take up more than MAP_CHUNK_MEMORY bytes.
+MAP_CHUNK_SIZE = 512
+MAP_CHUNK_MARGIN = 256
+MAP_CHUNK_MEMORY = 64 * 1024 * 1024
+# Levels (in maps/), played in this order. The level manager (levels.py) parses
+# the next level in the background while the current one is played, and keeps the
+# last LEVEL_CACHE parsed levels around so restarting doesn't parse them again.
+# Up to LEVEL_PREBUILD_MEMORY bytes of each levels map chunks are rendered in the
+# background too, nearest the players spawn first. Those are kept with the level,
+# on top of MAP_CHUNK_MEMORY, so they can take up to LEVEL_CACHE *
+# LEVEL_PREBUILD_MEMORY bytes more.
+LEVELS = ['level1.tmx']
+LEVEL_CACHE = 3
+LEVEL_PREBUILD_MEMORY = 32 * 1024 * 1024
+# Load levels from their compiled .zmap files (python mapcompiler.py maps/*.tmx)
+# instead of parsing the .tmx, when there's an up to date one. Needs numpy.
+COMPILED_MAPS = "ON"
+# Endless world (world.py): instead of a level, play in a procedural world that's
+# made from the games seed, one WORLD_REGION pixel square region at a time, as the
+# camera gets within WORLD_LOAD_MARGIN pixels of it. Regions further than
+# WORLD_UNLOAD_MARGIN from the camera are thrown away, with their walls, items and
+# any zombies in them. WORLD_REGION must be a whole number of map chunks.
+WORLD_MODE = "OFF"
+WORLD_REGION = 1024
+WORLD_LOAD_MARGIN = 512
+WORLD_UNLOAD_MARGIN = 1536
+# What each region gets: (least, most) walls and zombies, and the chance of a health pack
+WORLD_WALLS = (2, 6)
+WORLD_ZOMBIES = (0, 6)
+WORLD_HEALTH_CHANCE = 0.15
+# Nothing is put within this many pixels of where the player starts
+WORLD_SAFE_RADIUS = 400
+# Ground tiles (numbers in the Tiled tileset) and how many region layouts to remember
+WORLD_TILESET = 'spritesheet_tiles.png'
+WORLD_GROUND_TILES = [0, 1, 2, 3]
+WORLD_LAYOUT_CACHE = 256
+# How many regions to remember the shot zombies and picked up health packs of
+# (the least recently unloaded ones are forgotten first, and come back full)
+WORLD_REMOVED_CACHE = 1024
+
 # Player settings
 PLAYER_SPEED = 300
 PLAYER_HEALTH = 150
@@ -52,13 +102,28 @@ KICKBACK = 200
 # Mob settings`
 MOB_IMG = 'zombie1_hold.png'
 MOB_DEATH = 'splat green.png'
-MOB_SPEED = random.choice([150, 100, 75, 125, 50])
+# One of these is picked for all the mobs at the start of every game (Game.new)
+MOB_SPEEDS = [150, 100, 75, 125, 50]
 MOB_HIT_RECT = pg.Rect(0,0,0,35)
 MOB_HEALTH = 100
 MOB_DAMAGE = 10
 MOB_KNOCKBACK = 20
 AVOID_RADIUS = 50
 DETECT_RADIUS = 1000
+# How far (in pixels of walking distance) the flow field spreads out from the player
+FLOW_RADIUS = DETECT_RADIUS * 1.5
+# Move the whole horde at once with numpy arrays (mobengine.py) instead of one
+# Mob at a time. Only used if numpy is installed.
+BATCHED_MOBS = "OFF"
+# Mob level of detail (lod.py). Mobs on the screen (or within LOD_SCREEN_MARGIN
+# pixels of it) are updated every tick. Mobs off the screen but within
+# DETECT_RADIUS of the player are only moved every LOD_NEAR_INTERVAL ticks, in
+# bigger steps, and their image isn't turned. Mobs further away sleep until the
+# player gets close. Mobs are sorted into these tiers every LOD_REFRESH ticks.
+LOD = "OFF"
+LOD_SCREEN_MARGIN = 128
+LOD_NEAR_INTERVAL = 4
+LOD_REFRESH = 8
 
 # Weapon settings
 BULLET_IMG = 'bullet.png'
@@ -84,6 +149,11 @@ WEAPONS['shotgun'] = {
                     'bullet_count': 12
                     }
 
+# Reuse a fixed set of bullets (bulletpool.py) instead of making a new sprite for
+# every bullet. Only used if numpy is installed.
+BULLET_POOL = "OFF"
+BULLET_POOL_SIZE = 256
+
 if DEBUG_MODE == "ON":
     BULLET_DAMAGE = MOB_HEALTH
 else:
@@ -96,6 +166,53 @@ DAMAGE_ALPHA = [i for i in range(0,255,25)]
 NIGHT_COLOR = (15, 15, 15)
 LIGHT_RADIUS = (500, 500)
 LIGHT_MASK = "lightsoft.png"
+# Size of the light around a muzzle flash
+MUZZLE_LIGHT_RADIUS = (200, 200)
+
+# Only redraw the parts of the screen that changed (renderer.py). Falls back to
+# redrawing everything when the camera scrolls, when there are more than
+# DIRTY_MAX_RECTS changed areas, or when more than DIRTY_MAX_AREA of the screen changed
+DIRTY_RECTS = "OFF"
+DIRTY_MAX_RECTS = 64
+DIRTY_MAX_AREA = 0.5
+# Sprites further than CULL_MARGIN pixels outside the screen aren't drawn
+CULL_MARGIN = TILESIZE
+
+# Rotated sprite images are cached at every ROTATION_STEP degrees (5 = 72 angles)
+# ROTATION_CACHE_SIZE is the most angles kept in memory for each image. It fits
+# every angle, so the cache only throws any out if ROTATION_STEP is made smaller.
+ROTATION_STEP = 5
+ROTATION_CACHE_SIZE = 72
+
+# Most fonts and rendered pieces of text kept in memory by Game.draw_text
+FONT_CACHE_SIZE = 8
+TEXT_CACHE_SIZE = 64
+# Sound effects are loaded the first time they're played, and the least recently
+# played ones are unloaded once they take up more than SOUND_CACHE_MEMORY bytes.
+# With SOUND_PRELOAD on, they're loaded on a background thread at the start instead
+# (until SOUND_CACHE_MEMORY is full).
+SOUND_CACHE_MEMORY = 8 * 1024 * 1024
+SOUND_PRELOAD = "OFF"
+# Mixer channels each kind of sound gets to itself (see VoiceManager). When they're
+# all busy, the least important sound is cut off. Every VOICE_FALLOFF pixels away
+# from the player makes a sound one priority level less important.
+VOICE_CHANNELS = {'effects': 2, 'player': 2, 'weapon': 3, 'zombie': 5}
+VOICE_FALLOFF = 500
+# Frame profiler (profiler.py). F3 shows the overlay (and starts recording if
+# PROFILER is off). Times are kept for percentiles over the last PROFILE_WINDOW
+# frames, and every frame (up to PROFILE_MAX_FRAMES) is written to PROFILE_DUMP
+# when the game quits, as CSV (or as JSON if the name ends in .json).
+PROFILER = "OFF"
+PROFILE_WINDOW = 300
+PROFILE_MAX_FRAMES = 36000
+PROFILE_OVERLAY_REFRESH = 15
+PROFILE_DUMP = "profile.csv"
+# Record every game's seed and input to REPLAY_FILE, to play it back later with
+# python replay.py (see replay.py). The game state is hashed every
+# REPLAY_CHECKPOINT ticks so a replay can tell exactly when it went different.
+RECORD_INPUT = "OFF"
+REPLAY_FILE = "session.rec"
+REPLAY_CHECKPOINT = 600
 
 # Sprite layers
 WALL_LAYER = 1
@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import OrderedDict
+from os import path
+import pygame as pg
+from settings import *
+
+# Stand-in for pg.mixer.Sound, used when the game runs without audio (headless).
+# It has the same methods the game calls on real sounds, they just don't do anything.
+class NullSound:
+    def play(self,*args,**kwargs):
+        return None
+
+    def stop(self):
+        pass
+
+    def set_volume(self,value):
+        pass
+
+    def get_volume(self):
+        return 0.0
+
+    def get_num_channels(self):
+        return 0
+
+    def get_length(self):
+        return 0.0
+
+# Sound manager
+#
+# load_data used to decode every sound effect up front, so all of them sat in
+# memory the whole game even though most (e.g. 9 different zombie moans) are rarely
+# heard. The manager only loads a sound the first time it's played, and once the
+# loaded sounds take up more than budget bytes, throws away the ones that haven't
+# been played for the longest (but never one that's playing right now).
+#
+# Sounds are known by their file name in snd/ (e.g. 'pain/8.wav'). Sounds can also
+# be loaded ahead of time on a background thread with preload, so the first play
+# doesn't stall the frame. The manager doesn't play anything itself, the
+# VoiceManager below gets sounds from it and plays them on its own channels.
+class SoundManager:
+    def __init__(self,folder,pack=None,budget=SOUND_CACHE_MEMORY,enabled=True):
+        self.folder = folder
+        # Asset pack to take already decoded sounds from (see assetpack.py), or None
+        self.pack = pack
+        self.budget = budget
+        # False when there's no audio (headless), then every sound is a NullSound
+        self.enabled = enabled
+        # Loaded sounds, least recently played first
+        self.cache = OrderedDict()
+        self.volumes = {}
+        # Per sound stats: name -> SoundStats
+        self.stats = {}
+        self.resident = 0
+        # The preload thread and the game can both load sounds, so the cache is locked
+        self.lock = threading.RLock()
+        self.thread = None
+
+    # Volume a sound is always played at (kept even if the sound gets evicted)
+    def set_volume(self,name,volume):
+        self.volumes[name] = volume
+        with self.lock:
+            if name in self.cache:
+                self.cache[name].set_volume(volume)
+
+    # Returns the sound, loading it if it isn't already loaded
+    def get(self,name):
+        if not self.enabled:
+            return NULL_SOUND
+        with self.lock:
+            sound = self.cache.get(name)
+            if sound is None:
+                sound = self.load(name)
+            else:
+                self.cache.move_to_end(name)
+            return sound
+
+    def load(self,name):
+        start = time.perf_counter()
+        sound = self.pack.sound(name) if self.pack else None
+        if sound is None:
+            sound = pg.mixer.Sound(path.join(self.folder, name))
+        if name in self.volumes:
+            sound.set_volume(self.volumes[name])
+        size = sound_bytes(sound)
+
+        stats = self.stats.setdefault(name, SoundStats())
+        stats.loads += 1
+        stats.load_time += time.perf_counter() - start
+        stats.bytes = size
+        self.cache[name] = sound
+        self.resident += size
+        self.evict()
+        return sound
+
+    # Drops the least recently played sounds until we're back under budget
+    def evict(self):
+        for name in list(self.cache):
+            if self.resident <= self.budget:
+                break
+            # The newest sound always stays (it's about to be played), and so does
+            # anything still playing
+            if name == next(reversed(self.cache)) or self.cache[name].get_num_channels():
+                continue
+            del self.cache[name]
+            self.resident -= self.stats[name].bytes
+            self.stats[name].bytes = 0
+            self.stats[name].evictions += 1
+
+    # Loads sounds ahead of time, in order, until the budget is full. With
+    # background=True it's done on another thread and this returns straight away.
+    def preload(self,names,background=True):
+        if not self.enabled:
+            return
+        if background:
+            self.thread = threading.Thread(target=self.preload, args=(list(names), False), daemon=True)
+            self.thread.start()
+            return
+        for name in names:
+            with self.lock:
+                if name in self.cache:
+                    continue
+                if self.resident >= self.budget:
+                    break
+                self.load(name)
+
+    # One line per sound that's been loaded: load time, memory and how often it's used
+    def report(self):
+        lines = ["{:<32}{:>7}{:>10}{:>12}{:>7}{:>7}".format(
+            "sound", "loads", "load ms", "resident", "plays", "evict")]
+        for name, stats in sorted(self.stats.items()):
+            lines.append("{:<32}{:>7}{:>10.2f}{:>12}{:>7}{:>7}".format(
+                name, stats.loads, stats.load_time * 1000, stats.bytes, stats.plays, stats.evictions))
+        lines.append("{} sounds loaded, {} bytes resident (budget {})".format(
+            len(self.cache), self.resident, self.budget))
+        return lines
+
+# Everything the SoundManager knows about one sound
+class SoundStats:
+    def __init__(self):
+        self.loads = 0
+        # Seconds spent loading it, over every load
+        self.load_time = 0.0
+        # Bytes of decoded samples it takes up right now (0 if it's not loaded)
+        self.bytes = 0
+        self.plays = 0
+        self.evictions = 0
+
+# Size of a sounds decoded samples, worked out from its length and the mixer format
+# (cheaper than get_raw, which copies all of them)
+def sound_bytes(sound):
+    frequency, size, channels = pg.mixer.get_init()
+    return int(round(sound.get_length() * frequency)) * abs(size) // 8 * channels
+
+NULL_SOUND = NullSound()
+
+# Voice manager
+#
+# The mixer only has a few channels (voices). When every one of them is busy,
+# pygame just doesn't play the new sound, so a horde of moaning zombies could stop
+# the players own gun from being heard, and the shotgun used to ask for the same
+# sound 12 times a shot.
+#
+# Every sound now goes through play with a category. Each category owns its own
+# channels (VOICE_CHANNELS), so zombies can only ever use up the zombie channels.
+# When all of a categories channels are busy, the least important sound playing
+# (lowest priority, then furthest from the player) is stopped to make room, if the
+# new one is more important. The same sound asked for twice in one frame is only
+# played once.
+class VoiceManager:
+    def __init__(self,game,sounds,channels=VOICE_CHANNELS):
+        self.game = game
+        self.sounds = sounds
+        self.enabled = sounds.enabled
+        # category -> list of pg.mixer.Channel
+        self.channels = {}
+        # channel -> (score, name) of what it's playing
+        self.playing = {}
+        if self.enabled:
+            total = sum(channels.values())
+            pg.mixer.set_num_channels(total)
+            # Stop Sound.play (anything not going through here) from taking our channels
+            pg.mixer.set_reserved(total)
+            first = 0
+            for category, count in channels.items():
+                self.channels[category] = [pg.mixer.Channel(i) for i in range(first, first + count)]
+                first += count
+        # Sounds played this frame, for deduplication
+        self.frame = set()
+        # Stats
+        self.played = 0
+        self.deduped = 0
+        self.stolen = 0
+        self.dropped = 0
+
+    # How important a sound is: its priority, less one for every VOICE_FALLOFF pixels
+    # between where it happened and the player
+    def score(self,priority,pos):
+        if pos is None:
+            return priority
+        return priority - (vec(pos) - self.game.player.pos).length() / VOICE_FALLOFF
+
+    # Plays a sound (file name in snd/) on one of the categories channels. pos is
+    # where it happened in the world, or None for sounds that aren't anywhere (HUD,
+    # the player). Returns the channel, or None if it wasn't played.
+    def play(self,category,name,priority=0,pos=None):
+        if name in self.frame:
+            self.deduped += 1
+            return None
+        self.frame.add(name)
+        if not self.enabled:
+            self.played += 1
+            return None
+
+        score = self.score(priority, pos)
+        channel = None
+        weakest = None
+        for candidate in self.channels[category]:
+            if not candidate.get_busy():
+                channel = candidate
+                break
+            if weakest is None or self.playing[candidate][0] < self.playing[weakest][0]:
+                weakest = candidate
+        if channel is None:
+            # Everything's busy: steal the weakest voice, if we're more important
+            if score < self.playing[weakest][0]:
+                self.dropped += 1
+                return None
+            weakest.stop()
+            channel = weakest
+            self.stolen += 1
+
+        channel.play(self.sounds.get(name))
+        self.sounds.stats[name].plays += 1
+        self.playing[channel] = (score, name)
+        self.played += 1
+        return channel
+
+    # Called at the start of every game update
+    def end_frame(self):
+        self.frame.clear()
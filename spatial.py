@@ -0,0 +1,211 @@
+import pygame as pg
+
+# Uniform spatial hash used to find sprites that are close to each other.
+# The world is cut up into square cells (cell_size wide), and every sprite
+# is dropped into the cell that its position falls in. To find the neighbours
+# of a point we only have to look at the 3x3 block of cells around it, instead
+# of looping over every single sprite in the group.
+#
+# As long as cell_size is at least as big as the search radius, anything within
+# the radius is guaranteed to be inside that 3x3 block.
+class SpatialHash:
+    def __init__(self,cell_size):
+        self.cell_size = cell_size
+        # Dictionary of (cell x, cell y) -> list of sprites in that cell
+        self.cells = {}
+
+    # Cell coordinates of a position
+    def key(self,pos):
+        return (int(pos[0] // self.cell_size), int(pos[1] // self.cell_size))
+
+    def clear(self):
+        self.cells = {}
+
+    def insert(self,sprite):
+        key = self.key(sprite.pos)
+        if key in self.cells:
+            self.cells[key].append(sprite)
+        else:
+            self.cells[key] = [sprite]
+
+    # Throws away the old cells and re-inserts every sprite. Sprites move every frame,
+    # so rebuilding once per frame is simpler (and about as fast) as moving sprites
+    # between cells one at a time.
+    def rebuild(self,sprites):
+        self.cells = {}
+        cells = self.cells
+        size = self.cell_size
+        for sprite in sprites:
+            key = (int(sprite.pos.x // size), int(sprite.pos.y // size))
+            if key in cells:
+                cells[key].append(sprite)
+            else:
+                cells[key] = [sprite]
+
+    # Returns every sprite in the 3x3 block of cells around pos
+    def nearby(self,pos):
+        cx, cy = self.key(pos)
+        found = []
+        for x in (cx - 1, cx, cx + 1):
+            for y in (cy - 1, cy, cy + 1):
+                cell = self.cells.get((x,y))
+                if cell:
+                    found.extend(cell)
+        return found
+
+# Static index of wall rects (broad phase for wall collisions)
+#
+# Walls never move once Game.new has loaded the map, so they're sorted into a
+# grid of cell_size squares once, and every wall query only tests the walls in
+# the cells the query rect overlaps, instead of every wall on the map. (In the
+# endless world, walls come and go with the regions around the player, see
+# world.py, so they can be added and removed one at a time too.)
+#
+# It also keeps count of how many rect tests it does, against how many a plain
+# spritecollide over every wall would have done, so we can see what it saves.
+class WallIndex:
+    def __init__(self,walls,cell_size):
+        self.cell_size = cell_size
+        self.build(walls)
+
+        # Stats for the current frame, and the last finished frame
+        self.queries = 0
+        self.checks = 0
+        self.last_queries = 0
+        self.last_checks = 0
+        self.checks_saved = 0
+
+    def build(self,walls):
+        # Keep the walls in the same order as the group, so the first wall hit is
+        # the same one spritecollide would have returned first. Removed walls
+        # leave a None behind, so the numbers of the others don't change.
+        self.walls = list(walls)
+        # wall -> its number (index into self.walls)
+        self.numbers = {}
+        # Dictionary of (cell x, cell y) -> list of wall numbers (indices into self.walls)
+        self.cells = {}
+        for i, wall in enumerate(self.walls):
+            self.numbers[wall] = i
+            self.insert(i, wall.rect)
+        self.count = len(self.walls)
+
+    def insert(self,i,rect):
+        for key in self.keys(rect):
+            if key in self.cells:
+                self.cells[key].append(i)
+            else:
+                self.cells[key] = [i]
+
+    # Adds a wall (after every wall already in)
+    def add(self,wall):
+        i = len(self.walls)
+        self.walls.append(wall)
+        self.numbers[wall] = i
+        self.insert(i, wall.rect)
+        self.count += 1
+
+    def remove(self,wall):
+        i = self.numbers.pop(wall)
+        self.walls[i] = None
+        for key in self.keys(wall.rect):
+            cell = self.cells[key]
+            cell.remove(i)
+            if not cell:
+                del self.cells[key]
+        self.count -= 1
+        # Once most of the list is gaps, number the walls that are left again
+        if len(self.walls) > 64 and self.count < len(self.walls) // 2:
+            self.build([wall for wall in self.walls if wall is not None])
+
+    # Every cell that a rect overlaps
+    def keys(self,rect):
+        size = self.cell_size
+        left = rect.left // size
+        right = (rect.right - 1) // size
+        top = rect.top // size
+        bottom = (rect.bottom - 1) // size
+        return [(x,y) for x in range(left, right + 1) for y in range(top, bottom + 1)]
+
+    # Walls that might touch rect, in group order
+    def candidates(self,rect):
+        self.queries += 1
+        keys = self.keys(rect)
+        # Most sprites are smaller than a cell, so usually there's only one cell
+        if len(keys) == 1:
+            return self.cells.get(keys[0], ())
+        found = set()
+        for key in keys:
+            cell = self.cells.get(key)
+            if cell:
+                found.update(cell)
+        return sorted(found)
+
+    # Every wall that collides with rect (same as spritecollide over the walls group)
+    def collide(self,rect):
+        hits = []
+        candidates = self.candidates(rect)
+        self.checks += len(candidates)
+        for i in candidates:
+            if rect.colliderect(self.walls[i].rect):
+                hits.append(self.walls[i])
+        return hits
+
+    # First wall that collides with rect, or None (same as spritecollideany)
+    def collideany(self,rect):
+        for i in self.candidates(rect):
+            self.checks += 1
+            if rect.colliderect(self.walls[i].rect):
+                return self.walls[i]
+        return None
+
+    # First wall hit by a box of half size (half_w, half_h) moving from start to end.
+    # Returns (how far along the move it hit, wall) or None. See sweep_rect.
+    def sweep(self,start,end,half_w,half_h):
+        left = min(start[0], end[0]) - half_w
+        top = min(start[1], end[1]) - half_h
+        area = pg.Rect(int(left), int(top),
+                       int(abs(end[0] - start[0]) + half_w * 2) + 2,
+                       int(abs(end[1] - start[1]) + half_h * 2) + 2)
+        first = None
+        for i in self.candidates(area):
+            self.checks += 1
+            t = sweep_rect(start, end, self.walls[i].rect, half_w, half_h)
+            if t is not None and (first is None or t < first[0]):
+                first = (t, self.walls[i])
+        return first
+
+    # Called once per frame by Game.update to roll the stats over
+    def end_frame(self):
+        self.last_queries = self.queries
+        self.last_checks = self.checks
+        # A spritecollide over the whole walls group tests every wall, every query
+        self.checks_saved = self.queries * self.count - self.checks
+        self.queries = 0
+        self.checks = 0
+
+# Swept box test (segment vs AABB, the "slab" method)
+#
+# A box of half size (half_w, half_h) moves in a straight line from start to end.
+# Returns how far along the line (0 = start, 1 = end) it first touches rect, or
+# None if it never does. Unlike checking for overlap after moving, this can't miss
+# a rect that the box jumps straight over in one frame.
+def sweep_rect(start,end,rect,half_w,half_h):
+    t_enter = 0.0
+    t_exit = 1.0
+    # Growing the rect by the box size means we only have to trace a point
+    for p, d, lo, hi in ((start[0], end[0] - start[0], rect.left - half_w, rect.right + half_w),
+                         (start[1], end[1] - start[1], rect.top - half_h, rect.bottom + half_h)):
+        if d == 0:
+            # Not moving on this axis, so it's either always inside the slab or never
+            if not lo < p < hi:
+                return None
+        else:
+            t1 = (lo - p) / d
+            t2 = (hi - p) / d
+            if t1 > t2:
+                t1, t2 = t2, t1
+            t_enter = max(t_enter, t1)
+            t_exit = min(t_exit, t2)
+            if t_enter >= t_exit:
+                return None
+    return t_enter
@@ -1,5 +1,6 @@
 import pygame as pg
 from tilemap import collide_hit_rect
+from spatial import sweep_rect
 from settings import *
 import random
 import pytweening as tween
@@ -8,7 +9,7 @@ import itertools
 vec = pg.math.Vector2
 
 
-def collide_with_walls(sprite, group, dir):
+def collide_with_walls(sprite, walls, dir):
     '''
         My nifty little collision checker.
         Having TWO checks ensures that in event of one x or y value collision,
@@ -21,15 +22,15 @@ def collide_with_walls(sprite, group, dir):
         movement
 
         This function is not a method of any class, which means that this function
-        will work with any sprite, give the sprite, the group the collision checker
-        must check with, and the direction.
+        will work with any sprite, give the sprite, the wall index the collision
+        checker must check with (game.wall_index, see spatial.py), and the direction.
 
     '''
 
     # If direction is x, perform collision checking for x axis
     if dir == 'x':
         # Detects collision between player and walls.
-        hits = pg.sprite.spritecollide(sprite, group, False, collide_hit_rect)
+        hits = walls.collide(sprite.hit_rect)
         # If hits == True.
         if hits:
             # If velocity is right,
@@ -44,7 +45,7 @@ def collide_with_walls(sprite, group, dir):
     # If direction is y, perform collision checking for y axis
     if dir == 'y':
         # Detects collision between player and walls.
-        hits = pg.sprite.spritecollide(sprite, group, False, collide_hit_rect)
+        hits = walls.collide(sprite.hit_rect)
         # If hits == True
         if hits:
             # If velocity is down
@@ -56,6 +57,31 @@ def collide_with_walls(sprite, group, dir):
             sprite.vel.y = 0
             sprite.hit_rect.centery = sprite.pos.y
 
+# Collision check for bullets hitting mobs, for use with groupcollide.
+# Checks the whole path the bullet took this frame (last_pos -> pos), not just
+# where it ended up, so fast bullets can't skip over a mob between frames.
+def collide_swept(mob, bullet):
+    return sweep_rect(bullet.last_pos, bullet.pos, mob.rect,
+                      bullet.rect.width / 2, bullet.rect.height / 2) is not None
+
+# Works like pg.sprite.groupcollide(mobs, bullets, False, True, collide_swept), but
+# much faster with lots of bullets and mobs. groupcollide does the swept test for
+# every mob and bullet pair. Here each bullet finds the mobs touching the box
+# around its path with one collidelistall first, and only does the swept test on
+# those. A bullet still hits the first mob (in group order) that it goes through.
+def collide_bullets(mobs,bullets):
+    mobs = mobs.sprites()
+    rects = [mob.rect for mob in mobs]
+    hits = {}
+    for bullet in bullets.sprites():
+        for i in bullet.swept_rect.collidelistall(rects):
+            if collide_swept(mobs[i], bullet):
+                hits.setdefault(mobs[i], []).append(bullet)
+                bullet.kill()
+                break
+    # In the same order groupcollide would give them
+    return dict((mob, hits[mob]) for mob in mobs if mob in hits)
+
 # Player sprite class
 class Player(pg.sprite.Sprite):
     def __init__(self,game,x,y):
@@ -119,41 +145,42 @@ class Player(pg.sprite.Sprite):
 
         self.vel = vec(0,0)
 
-        # Event handling of keyboard input
-
-        keys = pg.key.get_pressed()
-        click = pg.mouse.get_pressed()
+        # What's being pressed this tick (the keyboard and mouse, or a recording,
+        # see replay.py)
+        input = self.game.input
 
         # If left or right, make the character rotate at player_rot_speed
-        if keys[pg.K_LEFT] or keys[pg.K_a]:
+        if input.left:
             self.rot_speed = PLAYER_ROT_SPEED
-        if keys[pg.K_RIGHT] or keys[pg.K_d]:
+        if input.right:
             self.rot_speed = -PLAYER_ROT_SPEED
 
         # If up or down, move up or down
-        if keys[pg.K_UP] or keys[pg.K_w]:
+        if input.up:
             self.vel = vec(PLAYER_SPEED,0).rotate(-self.rot)
-        if keys[pg.K_DOWN] or keys[pg.K_s]:
+        if input.down:
             self.vel = vec(-PLAYER_SPEED/2,0).rotate(-self.rot)
 
-        # Shoot when space is pressed
-        if keys[pg.K_SPACE] or click[0] == 1:
+        # Shoot when space (or the left mouse button) is pressed
+        if input.shoot:
             self.shoot()
 
     def shoot(self):
-        now = pg.time.get_ticks()
+        now = self.game.sim_time
         if now - self.last_shot > WEAPONS[self.weapon]['rate']:
             self.last_shot = now
             dir = vec(1, 0).rotate(-self.rot)
             pos = self.pos + BARREL_OFFSET.rotate(-self.rot)
             self.vel = vec(-WEAPONS[self.weapon]['kickback'], 0).rotate(-self.rot)
-            for i in range(WEAPONS[self.weapon]['bullet_count']):
-                spr = random.uniform(-WEAPONS[self.weapon]['spread'], WEAPONS[self.weapon]['spread'])
-                Bullet(self.game, pos, dir.rotate(spr),WEAPONS[self.weapon]['damage'])
-                snd = random.choice(self.game.weapon_sounds[self.weapon])
-                if snd.get_num_channels() > 2:
-                    snd.stop()
-                snd.play()
+            weapon = WEAPONS[self.weapon]
+            for i in range(weapon['bullet_count']):
+                spr = random.uniform(-weapon['spread'], weapon['spread'])
+                if self.game.bullet_pool:
+                    self.game.bullet_pool.fire(pos, dir.rotate(spr), weapon)
+                else:
+                    Bullet(self.game, pos, dir.rotate(spr),weapon['damage'])
+            # One gunshot sound per shot, not one per bullet
+            self.game.voices.play('weapon', random.choice(WEAPON_SOUNDS[self.weapon]), 2)
             MuzzleFlash(self.game,pos)
 
     def hit(self):
@@ -166,11 +193,16 @@ class Player(pg.sprite.Sprite):
 
         # Transform the image of the player so it rotates
         # Rotates image around the centre to ensure consistent movement
-        self.image = pg.transform.rotate(self.game.player_img, self.rot)
+        # (the rotated images are cached, see cache.py)
+        self.image = self.game.player_rotations.get(self.rot)
         if self.damaged:
             try:
-                self.image.fill((255,0,0, next(self.damage_alpha)), special_flags = pg.BLEND_RGBA_MULT)
-            except:
+                # The red tinted image comes from its own rotation cache, and fades
+                # in with its surface alpha, so nothing gets copied or filled per frame
+                alpha = next(self.damage_alpha)
+                self.image = self.game.player_damage_rotations.get(self.rot)
+                self.image.set_alpha(alpha)
+            except StopIteration:
                 self.damaged = False
 
         self.pos += self.vel * self.game.dt
@@ -187,13 +219,13 @@ class Player(pg.sprite.Sprite):
         self.hit_rect.centerx = self.pos.x
 
         # Calls collide_with_walls('x') every frame, checking if theres a collision
-        collide_with_walls(self,self.game.walls,'x')
+        collide_with_walls(self,self.game.wall_index,'x')
 
         # Update y value
         self.hit_rect.centery = self.pos.y
 
         # Calls collide_with_walls('y') every frame
-        collide_with_walls(self,self.game.walls,'y')
+        collide_with_walls(self,self.game.wall_index,'y')
 
         self.rect.center = self.hit_rect.center
 
@@ -214,7 +246,8 @@ class Mob(pg.sprite.Sprite):
         # Initalizes into groups (defined above)
         pg.sprite.Sprite.__init__(self,self.groups)
 
-        self.image = game.mob_img.copy()
+        # Every mob shares the same image (nothing ever draws on it)
+        self.image = game.mob_img
         self.rect = self.image.get_rect()
         self.hit_rect = MOB_HIT_RECT.copy()
         self.hit_rect.center = self.rect.center
@@ -222,7 +255,7 @@ class Mob(pg.sprite.Sprite):
         self.rect.center = self.pos
         self.rot = 0
         self.health = 100
-        self.speed = MOB_SPEED
+        self.speed = game.mob_speed
         self.target = game.player
 
         # Vectors
@@ -230,14 +263,16 @@ class Mob(pg.sprite.Sprite):
         self.acc = vec(0,0)
 
     def avoid_mobs(self):
-        # For each mob in mobs
-        for mob in self.game.mobs:
+        # Only mobs in the 3x3 cells around this one can be closer than AVOID_RADIUS,
+        # so ask the spatial hash (rebuilt every frame in Game.update) for those
+        # instead of looping over every mob in the game.
+        for mob in self.game.mob_grid.nearby(self.pos):
             # Ignore current mob
             if mob != self:
                 # Get the distance between current mob and mob in group
                 dist = self.pos - mob.pos
-                # If the distance between them is less than 50
-                if 0 < dist.length() < AVOID_RADIUS:
+                # If the distance between them is less than AVOID_RADIUS
+                if 0 < dist.length_squared() < AVOID_RADIUS**2:
                     # Spread them throughout a radius to avoid them clumping up
                     self.acc += dist.normalize()
 
@@ -250,9 +285,14 @@ class Mob(pg.sprite.Sprite):
         # detection radius, make the mob move and do its usual stuff
         if target_dist.length_squared() < DETECT_RADIUS**2:
             if random.random() < 0.002:
-                random.choice(self.game.zombie_moan_sounds).play()
-            self.rot = target_dist.angle_to(vec(1,0))
-            self.image = pg.transform.rotate(self.game.mob_img, self.rot)
+                self.game.voices.play('zombie', random.choice(ZOMBIE_MOAN_SOUNDS), 0, self.pos)
+            # Walk the way the flow field says (around walls) or, if it doesn't know,
+            # straight at the player
+            steer = self.game.flow_field.direction(self.pos)
+            if steer is None:
+                steer = target_dist
+            self.rot = steer.angle_to(vec(1,0))
+            self.image = self.game.mob_rotations.get(self.rot)
             self.rect = self.image.get_rect()
             self.rect.center = self.pos
 
@@ -264,32 +304,136 @@ class Mob(pg.sprite.Sprite):
 
             # Use self.speed as MOB_SPEEDS has a bunch of varying speeds, meaning
             # zombies will have different speeds, instead of all them being statically
-            # moving together
-            self.acc.scale_to_length(self.speed)
+            # moving together. (Seeking and avoiding can cancel out, and pygame can't
+            # scale a (nearly) zero vector, so then the mob just doesn't push this frame)
+            if self.acc.length_squared() > 1e-6:
+                self.acc.scale_to_length(self.speed)
             self.acc += self.vel * -1
             self.vel += self.acc * self.game.dt
             self.pos += self.vel * self.game.dt + 0.5 * self.acc * self.game.dt ** 2
             self.hit_rect.centerx = self.pos.x
-            collide_with_walls(self, self.game.walls, 'x')
+            collide_with_walls(self, self.game.wall_index, 'x')
             self.hit_rect.centery = self.pos.y
-            collide_with_walls(self,self.game.walls,'y')
+            collide_with_walls(self,self.game.wall_index,'y')
+
+        self.check_health()
+
+    # Cheap update for mobs off the screen (see lod.py). Moves the mob one big step
+    # of dt seconds along the flow field, without pushing away from other mobs, and
+    # doesn't turn the image (nobody can see it). Still stops at walls.
+    def update_far(self,dt):
+        # Same chance of moaning per second as in update
+        if random.random() < 0.002 * dt / self.game.dt:
+            self.game.voices.play('zombie', random.choice(ZOMBIE_MOAN_SOUNDS), 0, self.pos)
+        steer = self.game.flow_field.direction(self.pos)
+        if steer is None:
+            steer = self.target.pos - self.pos
+        if steer.length_squared() > 1e-6:
+            self.rot = steer.angle_to(vec(1,0))
+        self.acc = vec(self.speed,0).rotate(-self.rot)
+        self.acc += self.vel * -1
+        self.vel += self.acc * dt
+        self.pos += self.vel * dt + 0.5 * self.acc * dt ** 2
+        self.hit_rect.centerx = self.pos.x
+        collide_with_walls(self, self.game.wall_index, 'x')
+        self.hit_rect.centery = self.pos.y
+        collide_with_walls(self,self.game.wall_index,'y')
+        self.rect.center = self.pos
+        self.check_health()
 
+    # Dies if its health has run out
+    def check_health(self):
         if self.health <= 0:
-            random.choice(self.game.zombie_hit_sounds).play()
+            self.game.voices.play('zombie', random.choice(ZOMBIE_HIT_SOUNDS), 1, self.pos)
             self.kill()
-            self.game.map_img.blit(self.game.splat, self.pos - vec(32,32))
-
-    def draw_health(self):
+            self.game.map_chunks.add_decal(self.game.splat, self.pos - vec(32,32))
+
+    # Colour and width of the health bar drawn along the top of the mob, or None at
+    # full health. The bar isn't drawn into the image (which is shared with every
+    # other mob facing the same way), Game.draw_overlays draws it over the top.
+    def health_bar(self):
+        if self.health >= MOB_HEALTH:
+            return None
         if self.health > 60:
             col = GREEN
         elif self.health > 30:
             col = YELLOW
         else:
             col = RED
-        width = int(self.rect.width * self.health / MOB_HEALTH)
-        self.health_bar = pg.Rect(0, 0, width, 7)
-        if self.health < MOB_HEALTH:
-            pg.draw.rect(self.image, col, self.health_bar)
+        return col, int(self.rect.width * self.health / MOB_HEALTH)
+
+# Mob that lives in the batched mob engine (mobengine.py)
+# All of its state (pos, vel, acc, rot, health, speed) is stored in the engines
+# numpy arrays, and these properties just read and write this mobs row. The engine
+# does all the moving, so update only has to rotate the image and check for death.
+class BatchedMob(Mob):
+    def __init__(self,game,x,y):
+        self.engine = game.mob_engine
+        # Need a slot before Mob.__init__ sets pos, vel, health etc.
+        self.slot = self.engine.add(x, y, game.mob_speed, MOB_HEALTH)
+        Mob.__init__(self,game,x,y)
+
+    def get_pos(self):
+        return vec(*self.engine.pos[self.slot])
+    def set_pos(self,value):
+        self.engine.pos[self.slot] = (value[0], value[1])
+    pos = property(get_pos, set_pos)
+
+    def get_vel(self):
+        return vec(*self.engine.vel[self.slot])
+    def set_vel(self,value):
+        self.engine.vel[self.slot] = (value[0], value[1])
+    vel = property(get_vel, set_vel)
+
+    def get_acc(self):
+        return vec(*self.engine.acc[self.slot])
+    def set_acc(self,value):
+        self.engine.acc[self.slot] = (value[0], value[1])
+    acc = property(get_acc, set_acc)
+
+    def get_rot(self):
+        return float(self.engine.rot[self.slot])
+    def set_rot(self,value):
+        self.engine.rot[self.slot] = value
+    rot = property(get_rot, set_rot)
+
+    def get_health(self):
+        return float(self.engine.health[self.slot])
+    def set_health(self,value):
+        self.engine.health[self.slot] = value
+    health = property(get_health, set_health)
+
+    def get_speed(self):
+        return float(self.engine.speed[self.slot])
+    def set_speed(self,value):
+        self.engine.speed[self.slot] = value
+    speed = property(get_speed, set_speed)
+
+    def update(self):
+        # The engine has already moved every mob this frame (MobEngine.update)
+        if self.engine.active[self.slot]:
+            if random.random() < 0.002:
+                self.game.voices.play('zombie', random.choice(ZOMBIE_MOAN_SOUNDS), 0, self.pos)
+            pos = self.pos
+            self.image = self.game.mob_rotations.get(self.rot)
+            self.rect = self.image.get_rect()
+            self.rect.center = pos
+            self.hit_rect.center = pos
+
+        self.check_health()
+
+    # Off the screen the engine still moves the mob every tick, this just catches
+    # the rects up, without turning the image (see lod.py)
+    def update_far(self,dt):
+        pos = self.pos
+        self.rect.center = pos
+        self.hit_rect.center = pos
+        self.check_health()
+
+    # Give the slot back to the engine when the mob dies
+    def kill(self):
+        self.engine.remove(self.slot)
+        pg.sprite.Sprite.kill(self)
 
 # Bullet sprite class
 class Bullet(pg.sprite.Sprite):
@@ -315,18 +459,72 @@ class Bullet(pg.sprite.Sprite):
         # spread =  random.uniform(-GUN_SPREAD, GUN_SPREAD)
 
         self.vel = dir * WEAPONS[game.player.weapon]['bullet_speed'] * random.uniform(0.9,1.1)
-        self.spawn_time = pg.time.get_ticks()
+        self.spawn_time = self.game.sim_time
         self.damage = damage
 
+        # Where the bullet was at the start of this frame (for swept collisions),
+        # and a box around the whole path it took this frame
+        self.last_pos = vec(pos)
+        self.swept_rect = self.rect.copy()
+        # True once the bullet has hit a wall
+        self.stopped = False
+
     def update(self):
+        # Bullet hit a wall last frame. It was kept alive until now so it could still
+        # hit any mob that was between it and the wall.
+        if self.stopped:
+            self.kill()
+            return
+
+        self.last_pos = vec(self.pos)
         self.pos += self.vel * self.game.dt
-        self.rect.center = self.pos
 
-        if pg.time.get_ticks() - self.spawn_time > WEAPONS[self.game.player.weapon]['bullet_lifetime']:
-            self.kill()
-        # If bullet hits any wall, it stops.
-        if pg.sprite.spritecollideany(self,self.game.walls):
+        if self.game.sim_time - self.spawn_time > WEAPONS[self.game.player.weapon]['bullet_lifetime']:
             self.kill()
+            return
+
+        # If bullet hits any wall along the way, it stops there.
+        hit = self.game.wall_index.sweep(self.last_pos, self.pos,
+                                         self.rect.width / 2, self.rect.height / 2)
+        if hit:
+            self.pos = self.last_pos.lerp(self.pos, hit[0])
+            self.stopped = True
+        self.rect.center = self.pos
+        start = self.rect.copy()
+        start.center = self.last_pos
+        # (Grown a pixel each way, rect centers get rounded)
+        self.swept_rect = self.rect.union(start).inflate(2, 2)
+
+# Bullet sprite that belongs to the BulletPool (bulletpool.py)
+# These are only made once, when the pool is made. Firing one just puts it back
+# into the sprite groups, and the pool moves it and takes it out again when it dies.
+class PooledBullet(pg.sprite.Sprite):
+    def __init__(self,game,slot):
+        # Setting layers
+        self._layer = BULLET_LAYER
+
+        # Starts off in no groups, until it's fired
+        pg.sprite.Sprite.__init__(self)
+
+        self.game = game
+        # Which row of the pools arrays belongs to this bullet
+        self.slot = slot
+        self.image = game.bullet_images['lg']
+        self.rect = self.image.get_rect()
+        self.hit_rect = self.rect
+        self.damage = 0
+
+    def fire(self,image,pos,damage):
+        self.image = image
+        self.rect = self.image.get_rect()
+        self.hit_rect = self.rect
+        self.rect.center = pos
+        self.damage = damage
+        self.add(self.game.all_sprites, self.game.bullets)
+
+    def update(self):
+        # Nothing to do, BulletPool.update moves every bullet at once
+        pass
 
 # Wall sprite class (obselete - unless using walls instead of a TiledMap)
 class Wall(pg.sprite.Sprite):
@@ -379,8 +577,8 @@ class MuzzleFlash(pg.sprite.Sprite):
         # Setting layers
         self._layer = EFFECTS_LAYER
 
-        # Defines which groups the sprite should be in
-        self.groups = game.all_sprites
+        # Defines which groups the sprite should be in (flashes also light up the fog)
+        self.groups = game.all_sprites, game.flashes
 
         # Initalizes into groups (defined above)
         pg.sprite.Sprite.__init__(self,self.groups)
@@ -394,11 +592,11 @@ class MuzzleFlash(pg.sprite.Sprite):
         self.rect = self.image.get_rect()
         self.pos = pos
         self.rect.center = pos
-        self.spawn_time = pg.time.get_ticks()
+        self.spawn_time = self.game.sim_time
         self.hit_rect = self.rect
 
     def update(self):
-        if pg.time.get_ticks() - self.spawn_time > FLASH_DURATION:
+        if self.game.sim_time - self.spawn_time > FLASH_DURATION:
             self.kill()
 
 class Item(pg.sprite.Sprite):
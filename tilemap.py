@@ -1,6 +1,7 @@
 import pygame as pg
 from settings import *
 from os import path
+from collections import OrderedDict
 import pytmx
 
 def collide_hit_rect(one,two):
@@ -43,6 +44,8 @@ class TiledMap:
         self.width = tm.width * tm.tilewidth
         self.height = tm.height * tm.tileheight
         self.tmxdata = tm
+        # Every object in the map (player, walls, zombies, items), for Game.new
+        self.objects = list(tm.objects)
 
     def render(self,surface):
         # Aliasing this command because I ceebs typing it over and over again..
@@ -62,6 +65,33 @@ class TiledMap:
                         surface.blit(tile,(x*self.tmxdata.tilewidth,
                                             y*self.tmxdata.tileheight))
 
+    # Which tiles are blocked by walls. Only compiled maps (mapcompiler.py) know
+    # that without looking at every wall, so this is None.
+    def blocked(self):
+        return None
+
+    # Renders just the tiles inside area (a rect in map pixels) onto surface, with
+    # the top left of area at the top left of surface. Used by ChunkedMap.
+    def render_area(self,surface,area):
+        ti = self.tmxdata.get_tile_image_by_gid
+        tw = self.tmxdata.tilewidth
+        th = self.tmxdata.tileheight
+        # Range of tiles that overlap the area
+        left = max(0, area.left // tw)
+        top = max(0, area.top // th)
+        right = min(self.tmxdata.width, (area.right + tw - 1) // tw)
+        bottom = min(self.tmxdata.height, (area.bottom + th - 1) // th)
+        for layer in self.tmxdata.visible_layers:
+            if isinstance(layer, pytmx.TiledTileLayer):
+                for y in range(top, bottom):
+                    row = layer.data[y]
+                    for x in range(left, right):
+                        gid = row[x]
+                        if gid:
+                            tile = ti(gid)
+                            if tile:
+                                surface.blit(tile, (x * tw - area.x, y * th - area.y))
+
     # Make a map by rendering all tiles in proper locations on a surface and return
     # the surface
     def make_map(self):
@@ -69,6 +99,155 @@ class TiledMap:
         self.render(temp_surface)
         return temp_surface
 
+# Draws a map in square chunks instead of as one giant surface.
+#
+# make_map renders the whole map onto one surface, which for a big map takes a
+# huge amount of memory. Instead the map is split into chunk_size x chunk_size
+# pieces, and each piece is only rendered the first time it comes near the
+# camera. Once the chunks take up more than max_bytes, the ones that were used
+# the longest time ago are thrown out (and rendered again if they're needed).
+#
+# source can be anything with width, height and render_area(surface, area),
+# like TiledMap.
+class ChunkedMap:
+    def __init__(self,source,chunk_size=MAP_CHUNK_SIZE,max_bytes=MAP_CHUNK_MEMORY,prebuilt=None):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.width = source.width
+        self.height = source.height
+        self.rect = pg.Rect(0, 0, self.width, self.height)
+        # (chunk x, chunk y) -> rendered surface, least recently used first
+        self.chunks = OrderedDict()
+        self.bytes = 0
+        # Images stamped onto the map (like splats), kept so that a chunk that gets
+        # thrown out still has them when it's rendered again.
+        # (chunk x, chunk y) -> list of (image, map position)
+        self.decals = {}
+        # Chunks used this frame, which mustn't be thrown out (cleared by begin_frame)
+        self.in_use = set()
+        # Chunks rendered ahead of time with no decals on them (see levels.py).
+        # They're shared with every other game on the same map, so they're never
+        # drawn on, a chunk with decals gets a copy instead. The level owns them,
+        # so they don't count towards max_bytes and are never thrown out.
+        self.prebuilt = prebuilt or {}
+        # Stats
+        self.rendered = 0
+        self.reused = 0
+        self.evicted = 0
+
+    # Rect (in map pixels) covered by a chunk
+    def chunk_rect(self,key):
+        size = self.chunk_size
+        return pg.Rect(key[0] * size, key[1] * size, size, size).clip(self.rect)
+
+    # Every chunk that overlaps area (a rect in map pixels)
+    def keys(self,area):
+        area = area.clip(self.rect)
+        if area.width <= 0 or area.height <= 0:
+            return []
+        size = self.chunk_size
+        return [(x,y) for y in range(area.top // size, (area.bottom - 1) // size + 1)
+                      for x in range(area.left // size, (area.right - 1) // size + 1)]
+
+    # Gets a chunk, rendering it if it isn't loaded
+    def chunk(self,key):
+        surface = self.chunks.get(key)
+        if surface is None:
+            if key in self.prebuilt:
+                self.reused += 1
+            else:
+                self.rendered += 1
+            surface = self.render(key)
+            self.chunks[key] = surface
+            self.bytes += self.cost(key, surface)
+            self.evict()
+        else:
+            self.chunks.move_to_end(key)
+        self.in_use.add(key)
+        return surface
+
+    # Makes the surface for a chunk: the prebuilt one if there is one, otherwise
+    # the tiles are rendered. Decals are drawn on top.
+    def render(self,key):
+        rect = self.chunk_rect(key)
+        decals = self.decals.get(key, ())
+        surface = self.prebuilt.get(key)
+        if surface is None:
+            surface = pg.Surface(rect.size)
+            self.source.render_area(surface, rect)
+        elif decals:
+            surface = surface.copy()
+        for image, pos in decals:
+            surface.blit(image, (pos[0] - rect.x, pos[1] - rect.y))
+        return surface
+
+    # Bytes a chunk takes up towards max_bytes. Prebuilt chunks are kept by the
+    # level whatever happens here, so they take up nothing.
+    def cost(self,key,surface):
+        if surface is self.prebuilt.get(key):
+            return 0
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    # Throws out the least recently used chunks until we're under max_bytes
+    def evict(self):
+        for key in list(self.chunks):
+            if self.bytes <= self.max_bytes:
+                break
+            if key in self.in_use:
+                continue
+            cost = self.cost(key, self.chunks[key])
+            if cost:
+                del self.chunks[key]
+                self.bytes -= cost
+                self.evicted += 1
+
+    # Starts a new frame, so the chunks used last frame can be thrown out again.
+    # Called once a frame by Game.draw, since draw can be called once for every
+    # dirty rect (see renderer.py).
+    def begin_frame(self):
+        self.in_use = set()
+
+    # Draws the chunks visible through the camera. If area (a rect on the screen) is
+    # given, only the chunks under that part of the screen are drawn.
+    def draw(self,surface,camera,area=None):
+        offset = camera.camera.topleft
+        view = surface.get_rect().move(-offset[0], -offset[1])
+        if area is not None:
+            view = area.move(-offset[0], -offset[1])
+        for key in self.keys(view):
+            rect = self.chunk_rect(key)
+            surface.blit(self.chunk(key), rect.move(offset))
+        # Chunks just outside the screen get rendered early, so they're ready by the
+        # time they scroll onto it
+        view = surface.get_rect().move(-offset[0], -offset[1])
+        for key in self.keys(view.inflate(MAP_CHUNK_MARGIN * 2, MAP_CHUNK_MARGIN * 2)):
+            self.chunk(key)
+
+    # Throws out the chunks and decals in area (a rect in map pixels). Used by the
+    # endless world (world.py) when it unloads a region, so they don't pile up.
+    def forget(self,area):
+        for key in self.keys(area):
+            if key not in self.in_use:
+                surface = self.chunks.pop(key, None)
+                if surface:
+                    self.bytes -= self.cost(key, surface)
+            self.decals.pop(key, None)
+
+    # Stamps an image onto the map permanently, with its top left at pos
+    def add_decal(self,image,pos):
+        pos = (int(pos[0]), int(pos[1]))
+        area = pg.Rect(pos, image.get_size())
+        for key in self.keys(area):
+            self.decals.setdefault(key, []).append((image, pos))
+            if key in self.chunks:
+                rect = self.chunk_rect(key)
+                if self.chunks[key] is self.prebuilt.get(key):
+                    self.chunks[key] = self.chunks[key].copy()
+                    self.bytes += self.cost(key, self.chunks[key])
+                self.chunks[key].blit(image, (pos[0] - rect.x, pos[1] - rect.y))
+        self.evict()
+
 # Controls the camera. Draws the map shifted with an offset.
 # Keeps everything consistent, keep track of an offset, how far to the left
 # or right do we want to draw the map?
@@ -79,6 +258,9 @@ class Camera:
         self.camera = pg.Rect(0,0,width,height)
         self.width = width
         self.height = height
+        # Where the camera is as of the last update. self.camera (what gets drawn)
+        # can be in between this and where it was before (see interpolate)
+        self.offset = (0,0)
 
     def apply(self,entity):
         return entity.rect.move(self.camera.topleft)
@@ -86,6 +268,15 @@ class Camera:
     def apply_rect(self,rect):
         return rect.move(self.camera.topleft)
 
+    # The part of the map that's on the screen, in map coordinates
+    def viewport(self):
+        return pg.Rect(-self.camera.x, -self.camera.y, WIDTH, HEIGHT)
+
+    # The same, but from where the last update put the camera rather than where it
+    # was drawn (see interpolate), so game logic doesn't depend on the frame rate
+    def sim_viewport(self):
+        return pg.Rect(-self.offset[0], -self.offset[1], WIDTH, HEIGHT)
+
     # Shift camera with player sprite.
     def update(self,target):
         x = -target.rect.centerx + int(WIDTH / 2)
@@ -97,3 +288,12 @@ class Camera:
         x = max(-(self.width - WIDTH), x)  # right
         y = max(-(self.height - HEIGHT), y)  # bottom
         self.camera = pg.Rect(x, y, self.width, self.height)
+        self.offset = (x, y)
+
+    # Puts the camera part of the way (alpha, 0 to 1) between the offset it had
+    # before the last update (previous) and the offset it has now. Used to draw
+    # smooth frames in between game updates.
+    def interpolate(self,previous,alpha):
+        x = previous[0] + (self.offset[0] - previous[0]) * alpha
+        y = previous[1] + (self.offset[1] - previous[1]) * alpha
+        self.camera = pg.Rect(round(x), round(y), self.width, self.height)
@@ -0,0 +1,241 @@
+import random
+from collections import OrderedDict
+from os import path
+import pygame as pg
+from settings import *
+from sprites import Obstacle, Item
+from flowfield import FlowField
+from mapcompiler import MapObject
+
+vec = pg.math.Vector2
+
+# Endless world (WORLD_MODE = "ON" in settings.py)
+#
+# Instead of one .tmx level, the world is made up as the player walks through it.
+# It's split into WORLD_REGION pixel square regions, and everything in a region
+# (its walls, zombies and health packs) comes from the games seed and the regions
+# coordinates, so a region always comes out the same however many times it's made.
+#
+# Only the regions near the camera exist as sprites. Every update, regions within
+# WORLD_LOAD_MARGIN of the screen are loaded (their Obstacle, Mob and Item sprites
+# are made) and regions more than WORLD_UNLOAD_MARGIN away are unloaded (their
+# sprites are killed, along with any zombie that's wandered into them, and the
+# map chunks and splats there are thrown out). Zombies and health packs that are
+# gone by the time their region is unloaded (shot, picked up, or wandered off to
+# another region) are remembered, and aren't made again when the region is
+# loaded again (for the last WORLD_REMOVED_CACHE regions unloaded). The map itself is drawn by the
+# normal ChunkedMap, which asks the world for the tiles of a chunk as it needs
+# them. So however far the player walks, only a few regions worth of sprites,
+# chunks and layouts are ever kept, and memory stays flat.
+#
+# pygame rects are 32 bit, so the world isn't actually endless: it's WORLD_SIZE
+# pixels square (about 16 million tiles across), and the player starts in the
+# middle of it, so the camera never gets anywhere near an edge to stop at.
+
+WORLD_SIZE = 2 ** 30
+# Gap between the tiles in the tileset image (the same as in maps/level1.tmx)
+TILESET_SPACING = 10
+
+class World:
+    def __init__(self,game,seed):
+        self.game = game
+        self.seed = seed
+        self.width = WORLD_SIZE
+        self.height = WORLD_SIZE
+        self.rect = pg.Rect(0, 0, WORLD_SIZE, WORLD_SIZE)
+        # Middle of the tile in the middle of the world
+        self.start = (WORLD_SIZE // 2 + TILESIZE // 2, WORLD_SIZE // 2 + TILESIZE // 2)
+        # The only thing in the world to begin with is the player (see Game.new)
+        self.objects = [MapObject('player', self.start[0], self.start[1], 0, 0)]
+
+        # Ground tiles, cut out of the tileset
+        img_folder = path.join(path.dirname(__file__), 'img')
+        sheet = pg.image.load(path.join(img_folder, WORLD_TILESET)).convert()
+        columns = (sheet.get_width() + TILESET_SPACING) // (TILESIZE + TILESET_SPACING)
+        self.ground = []
+        for tile in WORLD_GROUND_TILES:
+            x = (tile % columns) * (TILESIZE + TILESET_SPACING)
+            y = (tile // columns) * (TILESIZE + TILESET_SPACING)
+            self.ground.append(sheet.subsurface((x, y, TILESIZE, TILESIZE)))
+        self.wall_img = game.wall_img
+        # Mixed into the ground tile hash, so every seed has different ground
+        self.tile_seed = seed & 0xFFFFFFFF
+
+        # (region x, region y) -> (wall rects, spawns), least recently used first
+        self.layouts = OrderedDict()
+        # (region x, region y) -> sprites made for it, for every loaded region
+        self.loaded = {}
+        # (region x, region y) -> {spawn index: sprite} of its zombies and health
+        # packs, for every loaded region
+        self.spawned = {}
+        # (region x, region y) -> indexes of the spawns that are gone for good, least
+        # recently unloaded first
+        self.removed = OrderedDict()
+        # Stats
+        self.regions_loaded = 0
+        self.regions_unloaded = 0
+        self.mobs_unloaded = 0
+
+    # Region that a position is in
+    def region(self,pos):
+        return (int(pos[0] // WORLD_REGION), int(pos[1] // WORLD_REGION))
+
+    # Rect (in map pixels) covered by a region
+    def region_rect(self,key):
+        return pg.Rect(key[0] * WORLD_REGION, key[1] * WORLD_REGION, WORLD_REGION, WORLD_REGION)
+
+    # Every region that overlaps area (a rect in map pixels)
+    def keys(self,area):
+        area = area.clip(self.rect)
+        if area.width <= 0 or area.height <= 0:
+            return []
+        size = WORLD_REGION
+        return [(x,y) for y in range(area.top // size, (area.bottom - 1) // size + 1)
+                      for x in range(area.left // size, (area.right - 1) // size + 1)]
+
+    # True if rect is too close to where the player starts to put anything in
+    def near_start(self,rect):
+        return rect.inflate(WORLD_SAFE_RADIUS * 2, WORLD_SAFE_RADIUS * 2).collidepoint(self.start)
+
+    # What's in a region: a list of wall rects, and a list of (name, x, y) spawns
+    def layout(self,key):
+        layout = self.layouts.get(key)
+        if layout is None:
+            layout = self.layouts[key] = self.generate(key)
+            if len(self.layouts) > WORLD_LAYOUT_CACHE:
+                self.layouts.popitem(last=False)
+        else:
+            self.layouts.move_to_end(key)
+        return layout
+
+    # Makes up a region. Only depends on the seed and the region, never on the
+    # games own random numbers, so it always comes out the same.
+    def generate(self,key):
+        rng = random.Random("%d:%d:%d" % (self.seed, key[0], key[1]))
+        area = self.region_rect(key)
+        tiles = WORLD_REGION // TILESIZE
+        walls = []
+        for i in range(rng.randint(*WORLD_WALLS)):
+            w, h = rng.choice(((1,1), (2,1), (1,2), (3,1), (1,3), (2,2)))
+            x = area.x + rng.randrange(tiles - w + 1) * TILESIZE
+            y = area.y + rng.randrange(tiles - h + 1) * TILESIZE
+            rect = pg.Rect(x, y, w * TILESIZE, h * TILESIZE)
+            if not self.near_start(rect):
+                walls.append(rect)
+
+        # Zombies and health packs go in the middle of tiles with no wall on them
+        spawns = []
+        names = ['zombie'] * rng.randint(*WORLD_ZOMBIES)
+        if rng.random() < WORLD_HEALTH_CHANCE:
+            names.append('health')
+        for name in names:
+            x = area.x + rng.randrange(tiles) * TILESIZE
+            y = area.y + rng.randrange(tiles) * TILESIZE
+            tile = pg.Rect(x, y, TILESIZE, TILESIZE)
+            if tile.collidelist(walls) == -1 and not self.near_start(tile):
+                spawns.append((name, x + TILESIZE / 2, y + TILESIZE / 2))
+        return walls, spawns
+
+    # Which tiles are blocked by walls. The world is far too big to say, so this is
+    # None (the flow field is made over the loaded regions instead, see walls_changed).
+    def blocked(self):
+        return None
+
+    # Draws the ground and walls inside area (a rect in map pixels) onto surface,
+    # with the top left of area at the top left of surface. Used by ChunkedMap.
+    def render_area(self,surface,area):
+        ground = self.ground
+        seed = self.tile_seed
+        blits = []
+        for ty in range(area.top // TILESIZE, (area.bottom + TILESIZE - 1) // TILESIZE):
+            for tx in range(area.left // TILESIZE, (area.right + TILESIZE - 1) // TILESIZE):
+                tile = ground[((tx * 73856093) ^ (ty * 19349663) ^ seed) % len(ground)]
+                blits.append((tile, (tx * TILESIZE - area.x, ty * TILESIZE - area.y)))
+        for key in self.keys(area):
+            for rect in self.layout(key)[0]:
+                if rect.colliderect(area):
+                    for y in range(rect.top, rect.bottom, TILESIZE):
+                        for x in range(rect.left, rect.right, TILESIZE):
+                            blits.append((self.wall_img, (x - area.x, y - area.y)))
+        surface.blits(blits, False)
+
+    # Loads and unloads regions around the camera. Called every update.
+    def update(self):
+        view = self.game.camera.viewport()
+        wanted = self.keys(view.inflate(WORLD_LOAD_MARGIN * 2, WORLD_LOAD_MARGIN * 2))
+        new = [key for key in wanted if key not in self.loaded]
+        keep = set(self.keys(view.inflate(WORLD_UNLOAD_MARGIN * 2, WORLD_UNLOAD_MARGIN * 2)))
+        gone = [key for key in self.loaded if key not in keep]
+        if not new and not gone:
+            return
+        for key in gone:
+            self.unload(key)
+        for key in new:
+            self.load(key)
+        if gone:
+            # Zombies don't stay in the region they were made in, so throw out any
+            # that are in a region that isn't loaded any more
+            for mob in list(self.game.mobs):
+                if self.region(mob.rect.center) not in self.loaded:
+                    mob.kill()
+                    self.mobs_unloaded += 1
+        self.walls_changed()
+
+    def load(self,key):
+        game = self.game
+        walls, spawns = self.layout(key)
+        sprites = []
+        for rect in walls:
+            wall = Obstacle(game, rect.x, rect.y, rect.width, rect.height)
+            game.wall_index.add(wall)
+            sprites.append(wall)
+        removed = self.removed.get(key, ())
+        spawned = {}
+        for i, (name, x, y) in enumerate(spawns):
+            if i in removed:
+                continue
+            if name == 'zombie':
+                spawned[i] = game.mob_class(game, x, y)
+            else:
+                spawned[i] = Item(game, vec(x, y), name)
+                sprites.append(spawned[i])
+        self.loaded[key] = sprites
+        self.spawned[key] = spawned
+        self.regions_loaded += 1
+
+    def unload(self,key):
+        game = self.game
+        # Anything shot, picked up, or not in this region any more (a zombie that
+        # followed the player) stays gone next time the region is loaded
+        gone = set(i for i, sprite in self.spawned.pop(key).items()
+                   if not sprite.alive() or self.region(sprite.rect.center) != key)
+        if gone:
+            self.removed[key] = gone.union(self.removed.get(key, ()))
+            self.removed.move_to_end(key)
+            if len(self.removed) > WORLD_REMOVED_CACHE:
+                self.removed.popitem(last=False)
+        for sprite in self.loaded.pop(key):
+            if sprite in game.walls:
+                game.wall_index.remove(sprite)
+            sprite.kill()
+        game.map_chunks.forget(self.region_rect(key))
+        self.regions_unloaded += 1
+
+    # Walls were added or removed, so everything made from the walls has to be made
+    # again: the flow field (which only covers the loaded regions), and the wall
+    # arrays of the mob engine and bullet pool
+    def walls_changed(self):
+        game = self.game
+        rects = [self.region_rect(key) for key in self.loaded]
+        area = rects[0].unionall(rects[1:])
+        game.flow_field = FlowField(game.walls, area.width, area.height, origin=area.topleft)
+        if game.mob_engine:
+            game.mob_engine.walls = None
+        if game.bullet_pool:
+            game.bullet_pool.walls = None
+
+    def report(self):
+        return ["world: {} regions loaded now, {} loaded and {} unloaded in all, {} zombies unloaded, "
+                "{} layouts remembered, {} spawns gone for good".format(
+                    len(self.loaded), self.regions_loaded, self.regions_unloaded, self.mobs_unloaded,
+                    len(self.layouts), sum(len(gone) for gone in self.removed.values()))]